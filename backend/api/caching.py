@@ -0,0 +1,93 @@
+import gzip
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+
+def reference_version_key(name):
+    return f'reference-version:{name}'
+
+
+def bump_reference_version(name):
+    """меняет версию справочника в общем кэше (CACHE_BACKEND): готовый
+    ответ перестраивается при следующем запросе во всех процессах;
+    вызывается сигналами моделей и командами загрузки"""
+    cache.set(reference_version_key(name), time.time_ns(), None)
+
+
+def reference_version(name):
+    """версия справочника хранится только в кэше, запрос к базе
+    не выполняется"""
+    key = reference_version_key(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+class RenderedBody:
+    """готовый ответ справочника: json, его gzip и etag для каждого"""
+
+    def __init__(self, version, body):
+        self.version = version
+        self.expires = time.monotonic() + settings.REFERENCE_CACHE_TTL
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.gzipped = self.gzip_etag = None
+        if settings.REFERENCE_CACHE_GZIP:
+            self.gzipped = gzip.compress(body, mtime=0)
+            self.gzip_etag = f'"{hashlib.sha1(self.gzipped).hexdigest()}"'
+
+    def response(self, request):
+        use_gzip = (self.gzipped is not None
+                    and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING',
+                                                   ''))
+        body, etag = ((self.gzipped, self.gzip_etag) if use_gzip
+                      else (self.body, self.etag))
+
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH',
+                                                     ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type='application/json')
+            if use_gzip:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class ReferenceCache:
+    """хранит в памяти процесса готовые ответы справочников под версией
+    из общего кэша; ответ старше REFERENCE_CACHE_TTL строится заново,
+    даже если версия не изменилась (кэш в памяти процесса не общий)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bodies = {}
+
+    def get(self, name, render):
+        version = reference_version(name)
+        rendered = self._bodies.get(name)
+        if self.is_stale(rendered, version):
+            with self._lock:
+                rendered = self._bodies.get(name)
+                if self.is_stale(rendered, version):
+                    rendered = RenderedBody(version, render())
+                    self._bodies[name] = rendered
+        return rendered
+
+    def is_stale(self, rendered, version):
+        return (rendered is None or rendered.version != version
+                or rendered.expires <= time.monotonic())
+
+
+reference_cache = ReferenceCache()
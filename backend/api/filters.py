@@ -1,10 +1,14 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import CharFilter, FilterSet, filters
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import Ingredient, Recipe, TagRecipe
+from recipes.search import search_recipes
 
 
 class RecipeFilter(FilterSet):
-    tags = CharFilter(field_name="tag__slug")
+    tags = CharFilter(method="filter_tags")
+    search = CharFilter(method="filter_search")
+    ordering = CharFilter(method="filter_ordering")
     is_favorited = filters.BooleanFilter(
         method="filter_is_favorited"
     )
@@ -14,7 +18,23 @@ class RecipeFilter(FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ["tag", "author", "is_favorited", "is_in_shopping_cart"]
+        fields = ["tag", "author", "is_favorited", "is_in_shopping_cart",
+                  "search", "ordering"]
+
+    def filter_tags(self, queryset, name, value):
+        """рецепты хотя бы с одним из тэгов, параметр tags может
+        повторяться; проверка через EXISTS не дает повторов рецептов"""
+        slugs = self.request.query_params.getlist(name) or [value]
+        return queryset.filter(Exists(TagRecipe.objects.filter(
+            recipe=OuterRef("pk"), tag__slug__in=slugs
+        )))
+
+    def filter_ordering(self, queryset, name, value):
+        """ordering=popular - сначала рецепты, которые чаще добавляют
+        в избранное и в корзину, по сохраненным счетчикам"""
+        if value == "popular":
+            return queryset.order_by("-favorites_count", "-carts_count", "id")
+        return queryset
 
     def filter_is_favorited(self, queryset, value, obj):
         if obj:
@@ -26,6 +46,16 @@ class RecipeFilter(FilterSet):
             return queryset.filter(cart__user=self.request.user)
         return queryset
 
+    def filter_search(self, queryset, name, value):
+        """полнотекстовый поиск по названию и описанию,
+        сначала самые релевантные рецепты"""
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value).order_by(
+            "-search_rank", *Recipe._meta.ordering
+        )
+
+
 class IngredientFilter(FilterSet):
     name = CharFilter(field_name='name', lookup_expr="icontains")
 
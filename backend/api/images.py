@@ -0,0 +1,102 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import features, Image, ImageOps
+
+from recipes.models import ImageTask, Recipe
+
+FORMATS = {
+    "webp": ("WEBP", {"method": 4}),
+    "jpeg": ("JPEG", {"optimize": True, "progressive": True}),
+}
+
+
+def enqueue_image_processing(recipe):
+    """ставит изображение рецепта в очередь на обработку"""
+    if recipe.image:
+        ImageTask.objects.create(recipe=recipe)
+
+
+def delete_image_variants(recipe):
+    """после фиксации транзакции удаляет уменьшенные копии изображения"""
+    delete_variant_files(recipe.image_variants)
+
+
+def delete_variant_files(variants):
+    names = [variant[image_format]
+             for variant in variants.values()
+             for image_format in FORMATS if variant.get(image_format)]
+
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+
+    transaction.on_commit(delete)
+
+
+def render_image_variants(recipe):
+    """создает файлы уменьшенных копий изображения рецепта в webp и jpeg
+    без метаданных и возвращает их пути и размеры"""
+    with recipe.image.open("rb") as file:
+        original = Image.open(file)
+        original = ImageOps.exif_transpose(original).convert("RGB")
+
+    variants = {}
+    for size_name, max_size in settings.RECIPE_IMAGE_SIZES.items():
+        image = original.copy()
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        variant = {"width": image.width, "height": image.height}
+        for image_format, (pillow_format, options) in FORMATS.items():
+            if pillow_format == "WEBP" and not features.check("webp"):
+                continue
+            buffer = BytesIO()
+            image.save(buffer, pillow_format,
+                       quality=settings.RECIPE_IMAGE_QUALITY, **options)
+            variant[image_format] = default_storage.save(
+                f"recipes/variants/{recipe.id}-{size_name}.{image_format}",
+                ContentFile(buffer.getvalue())
+            )
+        variants[size_name] = variant
+    return variants
+
+
+def process_recipe_image(recipe):
+    """создает уменьшенные копии изображения рецепта вне транзакции и
+    сохраняет их под блокировкой рецепта; если рецепт удален или его
+    изображение за это время сменилось, копии удаляются и возвращается
+    False"""
+    variants = render_image_variants(recipe) if recipe.image else {}
+    with transaction.atomic():
+        current = Recipe.objects.select_for_update().only(
+            "id", "image", "image_variants"
+        ).filter(pk=recipe.pk).first()
+        if current is None or current.image.name != recipe.image.name:
+            delete_variant_files(variants)
+            return False
+        delete_image_variants(current)
+        current.image_variants = variants
+        current.save(update_fields=["image_variants"])
+    return True
+
+
+def image_srcset(recipe, request=None):
+    """возвращает словарь адресов уменьшенных копий изображения"""
+    srcset = {}
+    for size_name, variant in recipe.image_variants.items():
+        srcset[size_name] = {
+            key: (value if key in ("width", "height")
+                  else default_storage.url(value))
+            for key, value in variant.items()
+        }
+        if request is not None:
+            for image_format in FORMATS:
+                if image_format in srcset[size_name]:
+                    srcset[size_name][image_format] = (
+                        request.build_absolute_uri(
+                            srcset[size_name][image_format]
+                        )
+                    )
+    return srcset
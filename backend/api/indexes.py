@@ -0,0 +1,209 @@
+import threading
+import time
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from recipes.models import Ingredient, IngredientRecipe
+
+
+def normalize_name(name):
+    """приводит название к виду для поиска: нижний регистр, е вместо ё"""
+    return name.strip().casefold().replace("ё", "е")
+
+
+class IngredientIndex:
+    """индекс названий ингредиентов в памяти процесса для автодополнения,
+    хранит отсортированные названия и ищет сначала совпадения по началу
+    названия, затем по вхождению, внутри группы выше популярные
+    ингредиенты, которые чаще используются в рецептах"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._data = [], []
+
+    def invalidate(self):
+        self._built_at = None
+
+    def build(self):
+        usage = dict(
+            IngredientRecipe.objects.values_list("ingredient").annotate(
+                Count("id")
+            ).order_by()
+        )
+        entries = sorted(
+            ((normalize_name(ingredient.name),
+              -usage.get(ingredient.id, 0),
+              ingredient)
+             for ingredient in Ingredient.objects.all()),
+            key=lambda entry: entry[:2]
+        )
+        self._data = [key for key, _, _ in entries], entries
+        self._built_at = time.monotonic()
+
+    def _is_fresh(self):
+        ttl = getattr(settings, "INGREDIENT_INDEX_TTL", None)
+        return self._built_at is not None and (
+            ttl is None or time.monotonic() - self._built_at < ttl
+        )
+
+    def _ensure_built(self):
+        if self._is_fresh():
+            return
+        with self._lock:
+            if not self._is_fresh():
+                self.build()
+
+    def search(self, name, limit=None):
+        """возвращает список ингредиентов, подходящих под name"""
+        query = normalize_name(name)
+        if not query:
+            return []
+        if limit is None:
+            limit = getattr(settings, "INGREDIENT_SEARCH_LIMIT", None)
+        self._ensure_built()
+        keys, entries = self._data
+
+        def rank(entry):
+            return entry[1], entry[0]
+
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + "\U0010ffff", start)
+        found = sorted(entries[start:end], key=rank)[:limit]
+
+        if limit is None or len(found) < limit:
+            substring = sorted(
+                (entries[i] for i in chain(range(start),
+                                           range(end, len(entries)))
+                 if query in entries[i][0]),
+                key=rank
+            )
+            found += substring[:None if limit is None
+                               else limit - len(found)]
+        return [ingredient for _, _, ingredient in found]
+
+
+ingredient_index = IngredientIndex()
+
+
+class PantryIndex:
+    """инвертированный индекс для подбора рецептов по продуктам: для
+    каждого ингредиента отсортированный массив id рецептов с ним и массив
+    количества ингредиентов в рецептах, индекс в массиве - id рецепта;
+    изменения рецептов применяются к индексу после фиксации транзакции,
+    другие процессы получают их при перестроении раз в PANTRY_INDEX_TTL"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built_at = None
+        self._postings = {}
+        self._totals = np.zeros(0, dtype=np.int64)
+
+    def invalidate(self):
+        self._built_at = None
+
+    def build(self):
+        pairs = np.fromiter(chain.from_iterable(
+            IngredientRecipe.objects.values_list(
+                "ingredient_id", "recipe_id"
+            ).order_by("ingredient_id", "recipe_id").iterator()
+        ), dtype=np.int64).reshape(-1, 2)
+        ingredients_id, recipes_id = pairs[:, 0], pairs[:, 1]
+        keys, starts = np.unique(ingredients_id, return_index=True)
+        self._postings = dict(zip(keys.tolist(),
+                                  np.split(recipes_id, starts[1:])))
+        self._totals = np.bincount(recipes_id)
+        self._built_at = time.monotonic()
+
+    def _is_fresh(self):
+        ttl = getattr(settings, "PANTRY_INDEX_TTL", None)
+        return self._built_at is not None and (
+            ttl is None or time.monotonic() - self._built_at < ttl
+        )
+
+    def add_ingredients(self, recipe_id, ingredients_id):
+        """добавляет в индекс ингредиенты рецепта"""
+        ingredients_id = list(ingredients_id)
+
+        def apply():
+            with self._lock:
+                if self._built_at is None:
+                    return
+                if recipe_id >= len(self._totals):
+                    self._totals = np.concatenate((
+                        self._totals,
+                        np.zeros(max(recipe_id + 1, 2 * len(self._totals))
+                                 - len(self._totals), dtype=np.int64)
+                    ))
+                for ingredient_id in ingredients_id:
+                    posting = self._postings.get(
+                        ingredient_id, np.zeros(0, dtype=np.int64)
+                    )
+                    position = np.searchsorted(posting, recipe_id)
+                    if (position < len(posting)
+                            and posting[position] == recipe_id):
+                        continue
+                    self._postings[ingredient_id] = np.insert(
+                        posting, position, recipe_id
+                    )
+                    self._totals[recipe_id] += 1
+
+        transaction.on_commit(apply)
+
+    def remove_ingredients(self, recipe_id, ingredients_id=None):
+        """убирает из индекса ингредиенты рецепта,
+        без ingredients_id - все ингредиенты удаленного рецепта"""
+        if ingredients_id is not None:
+            ingredients_id = list(ingredients_id)
+
+        def apply():
+            with self._lock:
+                if self._built_at is None or recipe_id >= len(self._totals):
+                    return
+                for ingredient_id in (self._postings.keys()
+                                      if ingredients_id is None
+                                      else ingredients_id):
+                    posting = self._postings.get(ingredient_id)
+                    if posting is None:
+                        continue
+                    position = np.searchsorted(posting, recipe_id)
+                    if (position < len(posting)
+                            and posting[position] == recipe_id):
+                        self._postings[ingredient_id] = np.delete(
+                            posting, position
+                        )
+                        self._totals[recipe_id] -= 1
+
+        transaction.on_commit(apply)
+
+    def search(self, ingredients_id, max_missing):
+        """возвращает id рецептов, в которых есть хотя бы один из
+        ингредиентов и не хватает не больше max_missing, и количество
+        недостающих ингредиентов: сначала рецепты, для которых есть все,
+        при равенстве - в которых больше имеющихся ингредиентов"""
+        with self._lock:
+            if not self._is_fresh():
+                self.build()
+            postings = [self._postings[ingredient_id]
+                        for ingredient_id in set(ingredients_id)
+                        if ingredient_id in self._postings]
+            if not postings:
+                return [], []
+            hits = np.bincount(np.concatenate(postings),
+                               minlength=len(self._totals))
+            recipes_id = np.flatnonzero(hits)
+            hits = hits[recipes_id]
+            missing = self._totals[recipes_id] - hits
+        found = missing <= max_missing
+        recipes_id, hits, missing = (recipes_id[found], hits[found],
+                                     missing[found])
+        order = np.lexsort((recipes_id, -hits, missing))
+        return recipes_id[order].tolist(), missing[order].tolist()
+
+
+pantry_index = PantryIndex()
@@ -0,0 +1,396 @@
+import json
+import math
+import time
+from collections import namedtuple
+from itertools import count
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.seeding import reset_caches, seed_dataset
+from api.urls import router
+from recipes.models import Ingredient, Recipe
+from .load_ingredients import read_csv
+
+PASSWORD = "Benchmark-password-1"
+
+# before и after - неизмеряемые запросы или функции до и после
+# измеряемого запроса, которые готовят и возвращают состояние базы;
+# data может зависеть от номера повтора, чтобы имена созданных
+# рецептов не повторялись
+Route = namedtuple("Route", "name method url data before after admin",
+                   defaults=(None, None, None, False))
+
+
+def new_recipe(context, number):
+    return {
+        "name": f"benchmark {number}",
+        "text": "benchmark",
+        "cooking_time": 10,
+        "tags": [context["tag_id"]],
+        "ingredients": [{"id": ingredient_id, "amount": 10}
+                        for ingredient_id in context["ingredients"][:5]],
+    }
+
+
+def restore_token(context):
+    """выход удаляет токен пользователя, он создается заново"""
+    Token.objects.get_or_create(user_id=context["user_id"],
+                                key=context["token"])
+
+
+def imported_recipe(context, number):
+    return json.dumps({
+        "name": f"benchmark import {number}",
+        "text": "benchmark",
+        "cooking_time": 10,
+        "tags": [context["tag"]],
+        "ingredients": [{"name": name, "measurement_unit": unit,
+                         "amount": 10}
+                        for name, unit in context["ingredient_names"]],
+    }, ensure_ascii=False) + "\n"
+
+
+ROUTES = (
+    Route("api-root", "get", "/api/"),
+    Route("users-list", "get", "/api/users/"),
+    Route("users-detail", "get", "/api/users/{author}/"),
+    Route("users-me", "get", "/api/users/me/"),
+    Route("users-subscriptions", "get",
+          "/api/users/subscriptions/?recipes_limit=3"),
+    Route("users-set-password", "post", "/api/users/set_password/",
+          {"current_password": PASSWORD, "new_password": PASSWORD}),
+    Route("subscribe-list", "post", "/api/users/{author}/subscribe/",
+          after=("delete", "/api/users/{author}/subscribe/delete/")),
+    Route("subscribe-delete", "delete",
+          "/api/users/{author}/subscribe/delete/",
+          before=("post", "/api/users/{author}/subscribe/")),
+    Route("tags-list", "get", "/api/tags/"),
+    Route("tags-detail", "get", "/api/tags/{tag_id}/"),
+    Route("ingredients-list", "get", "/api/ingredients/?name={prefix}"),
+    Route("ingredients-detail", "get", "/api/ingredients/{ingredient}/"),
+    Route("recipes-list", "get", "/api/recipes/"),
+    Route("recipes-list-filtered", "get",
+          "/api/recipes/?tags={tag}&is_favorited=1"),
+    Route("recipes-list-search", "get", "/api/recipes/?search={word}"),
+    Route("recipes-detail", "get", "/api/recipes/{recipe}/"),
+    Route("recipes-create", "post", "/api/recipes/", new_recipe,
+          after=("delete", "/api/recipes/{created}/")),
+    Route("recipes-update", "patch", "/api/recipes/{own_recipe}/",
+          lambda context, number: {"cooking_time": 10 + number % 2}),
+    Route("recipes-delete", "delete", "/api/recipes/{created}/",
+          before=("post", "/api/recipes/", new_recipe)),
+    Route("recipes-feed", "get", "/api/recipes/feed/"),
+    Route("recipes-trending", "get", "/api/recipes/trending/"),
+    Route("recipes-pantry", "get",
+          "/api/recipes/pantry/?ingredients={pantry}"),
+    Route("recipes-download-shopping-cart", "get",
+          "/api/recipes/download_shopping_cart/"),
+    Route("recipes-export-recipes", "get", "/api/recipes/export/",
+          admin=True),
+    Route("recipes-import-recipes", "post", "/api/recipes/import/",
+          imported_recipe, admin=True),
+    Route("favorite-list", "post", "/api/recipes/{recipe}/favorite/",
+          after=("delete", "/api/recipes/{recipe}/favorite/delete/")),
+    Route("favorite-delete", "delete",
+          "/api/recipes/{recipe}/favorite/delete/",
+          before=("post", "/api/recipes/{recipe}/favorite/")),
+    Route("shopping_cart-list", "post",
+          "/api/recipes/{recipe}/shopping_cart/",
+          after=("delete", "/api/recipes/{recipe}/shopping_cart/delete/")),
+    Route("shopping_cart-delete", "delete",
+          "/api/recipes/{recipe}/shopping_cart/delete/",
+          before=("post", "/api/recipes/{recipe}/shopping_cart/")),
+    Route("login", "post", "/api/auth/token/login/",
+          {"email": "{email}", "password": PASSWORD}),
+    Route("logout", "post", "/api/auth/token/logout/",
+          after=restore_token),
+)
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "queries", "bytes")
+
+
+def percentile(values, share):
+    """перцентиль по ближайшему рангу, values отсортированы"""
+    return values[max(math.ceil(share * len(values)) - 1, 0)]
+
+
+def read_run(path):
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)["endpoints"]
+    except (OSError, ValueError, KeyError) as error:
+        raise CommandError(f"Не удалось прочитать {path}: {error}")
+
+
+def compare_endpoint(name, before, after, threshold):
+    """возвращает признак регрессии эндпоинта и строку отчета
+    с изменением каждой метрики"""
+    changes = []
+    regressed = False
+    for metric in METRICS:
+        old, new = before[metric], after[metric]
+        change = (new - old) / old if old else 0
+        changes.append(f"{metric} {old} -> {new} ({change:+.0%})")
+        if metric in ("p50_ms", "p95_ms") and change > threshold:
+            regressed = True
+        if metric == "queries" and new > old:
+            regressed = True
+    return regressed, f"{name}: " + ", ".join(changes)
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу данными заданного размера, выполняет запросы "
+            "ко всем эндпоинтам api через тестовый клиент и выводит "
+            "в json задержку p50/p95/p99, количество запросов к базе и "
+            "размер ответа; изменения откатываются. С --compare "
+            "сравнивает два сохраненных прогона")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--recipes", type=int, default=5000)
+        parser.add_argument("--tags", type=int, default=10)
+        parser.add_argument("--ingredients", type=int, default=2000,
+                            help="сколько ингредиентов взять из файла")
+        parser.add_argument("--favorites", type=int, default=20,
+                            help="избранных рецептов на пользователя")
+        parser.add_argument("--carts", type=int, default=5,
+                            help="рецептов в корзине на пользователя")
+        parser.add_argument("--subscriptions", type=int, default=10,
+                            help="подписок на пользователя")
+        parser.add_argument("--ingredients-file",
+                            default=str(settings.BASE_DIR.parent / "data"
+                                        / "ingredients.csv"))
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument("--route", action="append", default=[],
+                            help="замерить только эти эндпоинты")
+        parser.add_argument("--output", help="файл для результата в json")
+        parser.add_argument("--compare", nargs=2,
+                            metavar=("BASELINE", "CURRENT"),
+                            help="сравнить два файла результатов")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.1,
+            help="рост задержки больше этой доли считается регрессией"
+        )
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            return self.compare(*options["compare"], options["threshold"])
+
+        routes = [route for route in ROUTES
+                  if not options["route"] or route.name in options["route"]]
+        unknown = set(options["route"]) - {route.name for route in routes}
+        if unknown:
+            raise CommandError(f"Нет эндпоинтов: {', '.join(unknown)}")
+        try:
+            with open(options["ingredients_file"], encoding="utf-8") as file:
+                ingredient_rows = list(read_csv(file))
+        except OSError as error:
+            raise CommandError(f"Не удалось прочитать ингредиенты: {error}")
+
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                data = seed_dataset(
+                    options["users"], options["recipes"],
+                    tags=options["tags"],
+                    ingredients=options["ingredients"],
+                    favorites=options["favorites"],
+                    carts=options["carts"],
+                    subscriptions=options["subscriptions"],
+                    ingredient_rows=iter(ingredient_rows)
+                )
+                self.stderr.write(f"Данные созданы за "
+                                  f"{time.perf_counter() - started:.1f} с")
+                endpoints = self.run(routes, data, options)
+                transaction.set_rollback(True)
+        finally:
+            reset_caches()
+
+        result = {
+            "meta": {
+                "created": timezone.now().isoformat(),
+                "database": connection.vendor,
+                "repeat": options["repeat"],
+                "dataset": {field: options[field] for field in (
+                    "users", "recipes", "tags", "ingredients", "favorites",
+                    "carts", "subscriptions")},
+            },
+            "endpoints": endpoints,
+            "uncovered": self.uncovered(),
+        }
+        output = json.dumps(result, ensure_ascii=False, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def run(self, routes, data, options):
+        user, admin = data["users"][0], data["users"][1]
+        for benchmark_user in (user, admin):
+            benchmark_user.set_password(PASSWORD)
+        admin.is_staff = True
+        for benchmark_user in (user, admin):
+            benchmark_user.save(update_fields=["password", "is_staff"])
+        own_recipe = Recipe.objects.filter(author=user).values_list(
+            "id", flat=True
+        ).first()
+        if own_recipe is None:
+            raise CommandError("У пользователя нет рецептов, "
+                               "увеличьте --recipes")
+        # автор для подписки и отписки, на которого пользователь
+        # еще не подписан в сгенерированных данных
+        followed = set(user.subscription.values_list("id", flat=True))
+        author = next((other.pk for other in data["users"][2:]
+                       if other.pk not in followed), None)
+        if author is None:
+            raise CommandError("Пользователь подписан на всех, "
+                               "увеличьте --users")
+        ingredients = data["ingredients"][:5]
+        context = {
+            "author": author,
+            "email": user.email,
+            "tag": data["tags"][0].slug,
+            "tag_id": data["tags"][0].pk,
+            "ingredient": ingredients[0],
+            "ingredients": ingredients,
+            "ingredient_names": list(Ingredient.objects.filter(
+                pk__in=ingredients
+            ).values_list("name", "measurement_unit")),
+            "recipe": data["recipes"][-1],
+            "own_recipe": own_recipe,
+            "pantry": ",".join(map(str, data["ingredients"][:20])),
+        }
+        context["prefix"] = context["ingredient_names"][0][0][:3]
+        context["word"] = Recipe.objects.get(pk=own_recipe).name.split()[-1]
+
+        clients = {}
+        for is_admin, benchmark_user in ((False, user), (True, admin)):
+            token = Token.objects.create(user=benchmark_user)
+            clients[is_admin] = APIClient()
+            clients[is_admin].credentials(
+                HTTP_AUTHORIZATION=f"Token {token.key}"
+            )
+        context["user_id"] = user.pk
+        context["token"] = Token.objects.get(user=user).key
+        numbers = count()
+
+        endpoints = {}
+        for route in routes:
+            client = clients[route.admin]
+            timings, queries, sizes, statuses = [], [], [], set()
+            for repeat in range(options["warmup"] + options["repeat"]):
+                number = next(numbers)
+                self.prepare(client, route.before, context, number)
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response, size = self.request(
+                        client, route.method, route.url, route.data,
+                        context=context, number=number
+                    )
+                    elapsed = time.perf_counter() - started
+                # следующий запрос клиента очищает журнал запросов к базе
+                queries_count = len(captured)
+                self.prepare(client, route.after, context, number)
+                if response.status_code >= 400:
+                    raise CommandError(
+                        f"{route.name}: {route.method.upper()} "
+                        f"{route.url.format(**context)} вернул "
+                        f"{response.status_code}: "
+                        f"{getattr(response, 'data', '')}"
+                    )
+                if repeat < options["warmup"]:
+                    continue
+                timings.append(elapsed * 1000)
+                queries.append(queries_count)
+                sizes.append(size)
+                statuses.add(response.status_code)
+
+            timings.sort()
+            endpoints[route.name] = {
+                "method": route.method.upper(),
+                "url": route.url,
+                "status": sorted(statuses),
+                "p50_ms": round(percentile(timings, 0.5), 3),
+                "p95_ms": round(percentile(timings, 0.95), 3),
+                "p99_ms": round(percentile(timings, 0.99), 3),
+                "queries": max(queries),
+                "bytes": max(sizes),
+            }
+            self.stderr.write(
+                f"{route.name}: p50 {endpoints[route.name]['p50_ms']} мс, "
+                f"запросов {endpoints[route.name]['queries']}"
+            )
+        return endpoints
+
+    def prepare(self, client, step, context, number):
+        if callable(step):
+            step(context)
+        elif step:
+            self.request(client, *step, context=context, number=number)
+
+    def request(self, client, method, url, data=None, context=None,
+                number=0):
+        """выполняет запрос, подставляя context в url и данные; ответ
+        потоком дочитывается; возвращает ответ и размер тела"""
+        url = url.format(**context)
+        if callable(data):
+            data = data(context, number)
+        if isinstance(data, dict):
+            data = {key: value.format(**context)
+                    if isinstance(value, str) else value
+                    for key, value in data.items()}
+        if isinstance(data, str):
+            response = getattr(client, method)(
+                url, data, content_type="application/x-ndjson"
+            )
+        else:
+            response = getattr(client, method)(url, data, format="json")
+        if response.streaming:
+            size = sum(map(len, response.streaming_content))
+        else:
+            size = len(response.content)
+        if method == "post" and url == "/api/recipes/" and (
+                response.status_code == 201):
+            context["created"] = Recipe.objects.values_list(
+                "id", flat=True
+            ).get(name=data["name"])
+        return response, size
+
+    def uncovered(self):
+        """маршруты роутера api, для которых нет замера"""
+        names = {route.name for route in ROUTES}
+        return sorted({url.name for url in router.urls
+                       if not any(name == url.name
+                                  or name.startswith(f"{url.name}-")
+                                  for name in names)})
+
+    def compare(self, baseline, current, threshold):
+        """сравнивает прогоны по эндпоинтам: регрессия - рост p50 или p95
+        больше чем на threshold или рост количества запросов к базе"""
+        runs = [read_run(path) for path in (baseline, current)]
+        baseline, current = runs
+
+        regressions = []
+        for name in sorted(baseline.keys() & current.keys()):
+            regressed, line = compare_endpoint(name, baseline[name],
+                                               current[name], threshold)
+            if regressed:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        for name in sorted(baseline.keys() - current.keys()):
+            self.stdout.write(f"{name}: нет в текущем прогоне")
+        for name in sorted(current.keys() - baseline.keys()):
+            self.stdout.write(f"{name}: нет в базовом прогоне")
+        if regressions:
+            raise CommandError(f"Регрессии: {', '.join(regressions)}")
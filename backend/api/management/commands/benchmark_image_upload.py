@@ -0,0 +1,95 @@
+import base64
+import io
+import json
+import multiprocessing
+import os
+import resource
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from recipes.models import Ingredient, Recipe, Tag, User
+from api.views import RecipeViewSet
+
+
+def make_image(size):
+    """png из шума почти не сжимается, поэтому размер файла
+    близок к заданному"""
+    side = int((size / 3) ** 0.5)
+    image = Image.frombytes("RGB", (side, side), os.urandom(side * side * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def upload(path, image, user_id, result):
+    """выполняется в отдельном процессе, чтобы пик памяти одного способа
+    загрузки не влиял на другой; тело запроса собирается до замера,
+    поэтому учитывается только обработка запроса сервером"""
+    ingredient = Ingredient.objects.values_list("id", flat=True).first()
+    tag = Tag.objects.values_list("id", flat=True).first()
+    fields = {"name": f"benchmark-{path}", "text": "benchmark",
+              "cooking_time": 1}
+    factory = APIRequestFactory()
+    if path == "base64":
+        request = factory.post("/api/recipes/", {
+            **fields,
+            "ingredients": [{"id": ingredient, "amount": "1"}],
+            "tags": [tag],
+            "image": ("data:image/png;base64,"
+                      + base64.b64encode(image).decode()),
+        }, format="json")
+    else:
+        file = io.BytesIO(image)
+        file.name = "benchmark.png"
+        request = factory.post("/api/recipes/", {
+            **fields,
+            "ingredients": json.dumps([{"id": ingredient, "amount": "1"}]),
+            "tags": [tag],
+            "image": file,
+        }, format="multipart")
+    force_authenticate(request, User.objects.get(id=user_id))
+    view = RecipeViewSet.as_view({"post": "create"})
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with transaction.atomic():
+        response = view(request)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        recipe = Recipe.objects.filter(name=f"benchmark-{path}").first()
+        if recipe is not None and recipe.image:
+            recipe.image.delete(save=False)
+        transaction.set_rollback(True)
+    result.put((response.status_code, (peak - before) / 1024))
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает пик памяти процесса при загрузке изображения "
+            "рецепта в base64 и файлом multipart")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size-mb", type=float, default=10)
+
+    def handle(self, *args, **options):
+        user = User.objects.first()
+        if user is None or not Ingredient.objects.exists() or (
+                not Tag.objects.exists()):
+            self.stderr.write("Нужны пользователь, тэг и ингредиент в базе")
+            return
+        image = make_image(int(options["size_mb"] * 1024 * 1024))
+        self.stdout.write(f"Размер изображения: {len(image) / 2**20:.1f} МБ")
+
+        context = multiprocessing.get_context("fork")
+        for path in ("base64", "multipart"):
+            connections.close_all()
+            result = context.Queue()
+            process = context.Process(target=upload,
+                                      args=(path, image, user.id, result))
+            process.start()
+            status_code, peak = result.get()
+            process.join()
+            self.stdout.write(
+                f"{path}: ответ {status_code}, "
+                f"прирост пика памяти {peak:.1f} МБ"
+            )
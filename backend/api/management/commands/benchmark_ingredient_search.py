@@ -0,0 +1,59 @@
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.models import Ingredient
+from api.indexes import ingredient_index
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает скорость поиска ингредиентов по индексу в памяти "
+            "и через запрос к базе")
+
+    def add_arguments(self, parser):
+        parser.add_argument("queries", nargs="*",
+                            help="строки поиска, по умолчанию случайные "
+                                 "начала названий ингредиентов")
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        queries = options["queries"]
+        if not queries:
+            names = list(Ingredient.objects.values_list("name", flat=True))
+            if not names:
+                self.stderr.write("В базе нет ингредиентов")
+                return
+            generator = random.Random(options["seed"])
+            queries = [name[:generator.randint(1, 4)]
+                       for name in generator.choices(names, k=20)]
+
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+
+        def orm_search(name):
+            """как индекс: сначала совпадения по началу названия,
+            затем по подстроке, не больше limit"""
+            found = list(Ingredient.objects.filter(
+                name__istartswith=name
+            )[:limit])
+            if len(found) < limit:
+                found += Ingredient.objects.filter(
+                    name__icontains=name
+                ).exclude(name__istartswith=name)[:limit - len(found)]
+            return found
+
+        def index_search(name):
+            return ingredient_index.search(name, limit)
+
+        ingredient_index.build()
+        for title, search in (("ORM", orm_search),
+                              ("индекс", index_search)):
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                for query in queries:
+                    search(query)
+            elapsed = time.perf_counter() - started
+            per_query = elapsed / (options["repeat"] * len(queries)) * 1e6
+            self.stdout.write(f"{title}: {per_query:.1f} мкс на запрос")
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from recipes.models import Ingredient, Tag, User
+from api.views import RecipeViewSet
+
+
+class Command(BaseCommand):
+    help = ("Измеряет время и количество запросов к базе при создании "
+            "рецепта с разным числом ингредиентов, изменения откатываются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+",
+                            default=[1, 10, 100])
+        parser.add_argument("--repeat", type=int, default=10)
+
+    def handle(self, *args, **options):
+        user = User.objects.first()
+        tag = Tag.objects.values_list("id", flat=True).first()
+        ingredients_id = list(Ingredient.objects.values_list(
+            "id", flat=True
+        ).order_by("id")[:max(options["sizes"])])
+        if user is None or tag is None or (
+                len(ingredients_id) < max(options["sizes"])):
+            self.stderr.write(
+                "Нужны пользователь, тэг и достаточно ингредиентов в базе"
+            )
+            return
+
+        factory = APIRequestFactory()
+        view = RecipeViewSet.as_view({"post": "create"})
+        for size in options["sizes"]:
+            timings = []
+            for number in range(options["repeat"]):
+                request = factory.post("/api/recipes/", {
+                    "name": f"benchmark-{size}-{number}",
+                    "text": "benchmark",
+                    "cooking_time": 1,
+                    "tags": [tag],
+                    "ingredients": [
+                        {"id": ingredient_id, "amount": "1"}
+                        for ingredient_id in ingredients_id[:size]
+                    ],
+                }, format="json")
+                force_authenticate(request, user)
+                with transaction.atomic():
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        response = view(request)
+                        timings.append(time.perf_counter() - started)
+                    transaction.set_rollback(True)
+                if response.status_code != 201:
+                    self.stderr.write(
+                        f"{size}: ответ {response.status_code} {response.data}"
+                    )
+                    return
+            timings.sort()
+            self.stdout.write(
+                f"ингредиентов {size}: запросов {len(queries)}, "
+                f"медиана {timings[len(timings) // 2] * 1000:.1f} мс"
+            )
@@ -0,0 +1,82 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from recipes.models import Recipe, User
+from recipes.search import search_recipes
+
+WORDS = ("картофель", "морковь", "курица", "говядина", "рис", "гречка",
+         "молоко", "сыр", "томаты", "лук", "чеснок", "перец", "суп",
+         "салат", "пирог", "запеканка", "соус", "жарить", "варить",
+         "запекать", "тушить", "нарезать", "смешать", "духовка")
+QUERIES = ("картофель", "курица рис", "запеканка сыр", "тушить говядина")
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает время полнотекстового поиска рецептов и поиска "
+            "через icontains на сгенерированных рецептах, "
+            "изменения откатываются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--vocabulary", type=int, default=5000,
+                            help="количество случайных слов в описаниях")
+
+    def handle(self, *args, **options):
+        author = User.objects.first()
+        if author is None:
+            self.stderr.write("Нужен пользователь в базе")
+            return
+        words = random.Random(0)
+        # кроме кулинарных слов в описаниях много редких слов,
+        # поэтому под запрос подходит только часть рецептов
+        vocabulary = WORDS + tuple(
+            "".join(words.choices("абвгдежзиклмнопрстуфхя", k=8))
+            for _ in range(options["vocabulary"])
+        )
+        with transaction.atomic():
+            started = time.perf_counter()
+            Recipe.objects.bulk_create((Recipe(
+                name=f"benchmark {number} " + " ".join(words.sample(WORDS, 3)),
+                text=" ".join(words.choices(vocabulary, k=40)),
+                cooking_time=10,
+                author=author
+            ) for number in range(options["recipes"])), batch_size=5000)
+            self.stdout.write(
+                f"Создано рецептов: {options['recipes']} за "
+                f"{time.perf_counter() - started:.1f} с"
+            )
+            for query in QUERIES:
+                search = self.measure(options["repeat"], self.search, query)
+                icontains = self.measure(options["repeat"], self.icontains,
+                                         query)
+                self.stdout.write(f"{query}: поиск {search:.1f} мс, "
+                                  f"icontains {icontains:.1f} мс")
+            transaction.set_rollback(True)
+
+    def search(self, query):
+        return search_recipes(Recipe.objects.all(), query).order_by(
+            "-search_rank", "name"
+        )
+
+    def icontains(self, query):
+        condition = Q()
+        for word in query.split():
+            condition &= Q(name__icontains=word) | Q(text__icontains=word)
+        return Recipe.objects.filter(condition).order_by("name")
+
+    def measure(self, repeat, method, query):
+        """медиана времени получения первой страницы и количества"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            recipes = method(query)
+            list(recipes[:9])
+            recipes.count()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        return timings[len(timings) // 2] * 1000
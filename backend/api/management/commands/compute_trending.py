@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.trending import compute_trending
+
+
+class Command(BaseCommand):
+    help = ("Пересчитывает популярность рецептов с затуханием по времени "
+            "по добавлениям в избранное и корзину с прошлого запуска, "
+            "запускается по расписанию")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        events = compute_trending(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано событий: {events} "
+            f"за {time.perf_counter() - started:.1f} с"
+        ))
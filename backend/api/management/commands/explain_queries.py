@@ -0,0 +1,162 @@
+import json
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.seeding import reset_caches, seed_dataset
+
+# (название, url, таблица основного запроса): основной запрос - первый
+# запрос к таблице, кроме подсчета количества
+CHECKS = (
+    ("список рецептов", "/api/recipes/", "recipes_recipe"),
+    ("рецепты автора", "/api/recipes/?author={author}", "recipes_recipe"),
+    ("рецепты по тэгам", "/api/recipes/?tags={tag}&tags={other_tag}",
+     "recipes_recipe"),
+    ("избранное", "/api/recipes/?is_favorited=1", "recipes_recipe"),
+    ("корзина", "/api/recipes/?is_in_shopping_cart=1", "recipes_recipe"),
+    ("рецепт", "/api/recipes/{recipe}/", "recipes_recipe"),
+    ("подписки", "/api/users/subscriptions/?recipes_limit=3",
+     "recipes_user"),
+    ("список покупок", "/api/recipes/download_shopping_cart/",
+     "recipes_shoppingcartingredient"),
+)
+ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)\b')
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?")
+
+
+def main_query(client, url, table):
+    """ответ эндпоинта и sql основного запроса к таблице table"""
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+        if response.streaming:
+            b"".join(response.streaming_content)
+    sql = next((query["sql"] for query in queries.captured_queries
+                if f'FROM "{table}"' in query["sql"]
+                and not query["sql"].startswith("SELECT COUNT(")), None)
+    return response, sql
+
+
+def check_context(data):
+    """значения для url из CHECKS по данным seed_dataset"""
+    return {
+        "author": data["users"][0].pk,
+        "tag": data["tags"][0].slug,
+        "other_tag": data["tags"][1].slug,
+        "recipe": data["recipes"][0],
+    }
+
+
+class Command(BaseCommand):
+    help = ("Заполняет базу тестовыми данными, получает планы EXPLAIN "
+            "основных запросов эндпоинтов и завершается ошибкой, если "
+            "запрос читает большую таблицу полным просмотром; "
+            "изменения откатываются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=20000)
+        parser.add_argument(
+            "--max-rows",
+            type=int,
+            default=1000,
+            help="полный просмотр таблицы больше стольких строк - ошибка"
+        )
+        parser.add_argument("--verbose-plans", action="store_true",
+                            help="выводить планы всех проверенных запросов")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.table_rows = {}
+
+    def handle(self, *args, **options):
+        failed = []
+        try:
+            with transaction.atomic():
+                data = seed_dataset(options["users"], options["recipes"])
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+                client = APIClient()
+                client.force_authenticate(data["users"][0])
+                context = check_context(data)
+                for name, url, table in CHECKS:
+                    if not self.check_endpoint(
+                            client, name, url.format(**context), table,
+                            options):
+                        failed.append(name)
+                transaction.set_rollback(True)
+        finally:
+            reset_caches()
+        if failed:
+            raise CommandError(
+                f"Полный просмотр больших таблиц: {', '.join(failed)}"
+            )
+
+    def check_endpoint(self, client, name, url, table, options):
+        response, sql = main_query(client, url, table)
+        if response.status_code != 200:
+            raise CommandError(f"{name}: {url} вернул {response.status_code}")
+        if sql is None:
+            raise CommandError(f"{name}: нет запроса к таблице {table}")
+
+        plan, large = self.large_scans(sql, options["max_rows"])
+        if large:
+            self.stdout.write(self.style.ERROR(
+                f"{name}: полный просмотр " + ", ".join(
+                    f"{scanned_table} ({rows} строк)"
+                    for scanned_table, rows in large.items()
+                )
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{name}: OK"))
+        if large or options["verbose_plans"]:
+            self.stdout.write(sql)
+            self.stdout.write(plan)
+        return not large
+
+    def large_scans(self, sql, max_rows):
+        """план запроса и полностью читаемые таблицы больше max_rows
+        строк с их количеством строк"""
+        plan, scanned = self.explain(sql)
+        return plan, {table: self.rows(table) for table in scanned
+                      if self.rows(table) > max_rows}
+
+    def explain(self, sql):
+        """план запроса текстом и таблицы, которые читаются полностью"""
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                return (json.dumps(plan, ensure_ascii=False, indent=2),
+                        set(self.postgresql_scans(plan[0]["Plan"])))
+
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            details = [row[-1] for row in cursor.fetchall()]
+        aliases = {alias: table for table, alias in ALIAS.findall(sql)}
+        scanned = set()
+        for detail in details:
+            match = SQLITE_SCAN.match(detail)
+            if match and "INDEX" not in detail:
+                name = match.group(2) or match.group(1)
+                scanned.add(aliases.get(name, name))
+        return "\n".join(details), scanned
+
+    def postgresql_scans(self, node):
+        if node["Node Type"] == "Seq Scan":
+            yield node["Relation Name"]
+        for child in node.get("Plans", ()):
+            yield from self.postgresql_scans(child)
+
+    def rows(self, table):
+        if table not in self.table_rows:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM "
+                    f"{connection.ops.quote_name(table)}"
+                )
+                self.table_rows[table] = cursor.fetchone()[0]
+        return self.table_rows[table]
@@ -0,0 +1,92 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from api.images import FORMATS
+
+
+def walk_files(path):
+    """обходит файлы каталога рекурсивно, не собирая их в список"""
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+class Command(BaseCommand):
+    help = ("Удаляет из MEDIA_ROOT файлы изображений рецептов, "
+            "на которые не ссылается ни один рецепт")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="не трогать файлы моложе указанного числа секунд, "
+                 "чтобы не удалить загрузку до сохранения рецепта"
+        )
+        parser.add_argument("--dry-run", action="store_true",
+                            help="только показать, что будет удалено")
+
+    def handle(self, *args, **options):
+        upload_to = Recipe._meta.get_field("image").upload_to
+        root = os.path.join(settings.MEDIA_ROOT, upload_to)
+        if not os.path.isdir(root):
+            self.stdout.write("Каталог изображений не найден")
+            return
+
+        referenced = set()
+        recipes = Recipe.objects.values_list("image", "image_variants")
+        for image, variants in recipes.iterator():
+            if image:
+                referenced.add(image)
+            for variant in (variants or {}).values():
+                referenced.update(variant[image_format]
+                                  for image_format in FORMATS
+                                  if variant.get(image_format))
+
+        oldest = time.time() - options["min_age"]
+        checked = deleted = freed = 0
+        batch = []
+        for entry in walk_files(root):
+            checked += 1
+            name = os.path.relpath(entry.path,
+                                   settings.MEDIA_ROOT).replace(os.sep, "/")
+            stat = entry.stat(follow_symlinks=False)
+            if name in referenced or stat.st_mtime > oldest:
+                continue
+            batch.append((entry.path, stat.st_size))
+            if len(batch) >= options["batch_size"]:
+                deleted, freed = self.delete(batch, deleted, freed,
+                                             oldest, options)
+                batch = []
+        deleted, freed = self.delete(batch, deleted, freed, oldest, options)
+
+        action = "Будет удалено" if options["dry_run"] else "Удалено"
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено файлов: {checked}, {action.lower()}: {deleted}, "
+            f"{freed / 2**20:.1f} МБ"
+        ))
+
+    def delete(self, batch, deleted, freed, oldest, options):
+        """время изменения проверяется еще раз перед удалением: повторная
+        загрузка того же файла обновляет его, пока собиралась пачка"""
+        for path, size in batch:
+            try:
+                if os.stat(path).st_mtime > oldest:
+                    continue
+                if options["dry_run"]:
+                    self.stdout.write(path)
+                else:
+                    os.remove(path)
+            except FileNotFoundError:
+                continue
+            deleted += 1
+            freed += size
+        return deleted, freed
@@ -0,0 +1,171 @@
+import csv
+import io
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from api.caching import bump_reference_version
+
+FIELDS = ("name", "measurement_unit")
+MAX_LENGTH = 200
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if tuple(row) == FIELDS:
+            continue
+        yield row
+
+
+def read_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json_array(file):
+    """читает json-массив объектов по частям, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    for chunk in iter(lambda: file.read(READ_SIZE), ""):
+        buffer += chunk
+        position = 0
+        while True:
+            while (position < len(buffer)
+                   and buffer[position] in " \t\r\n,[]"):
+                if buffer[position] == "[":
+                    started = True
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                raise CommandError("Ожидается json-массив ингредиентов")
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise CommandError("Некорректный json в конце файла")
+
+
+READERS = {
+    "csv": read_csv,
+    "json": read_json_array,
+    "jsonl": read_json_lines,
+}
+
+
+def clean_row(row):
+    """возвращает пару (название, единица измерения) или None"""
+    if isinstance(row, dict):
+        row = [row.get(field) for field in FIELDS]
+    if len(row) != len(FIELDS):
+        return None
+    name, measurement_unit = (str(value or "").strip() for value in row)
+    if (not name or not measurement_unit
+            or len(name) > MAX_LENGTH
+            or len(measurement_unit) > MAX_LENGTH):
+        return None
+    return name, measurement_unit
+
+
+class Command(BaseCommand):
+    help = ("Загружает ингредиенты из csv (название, единица измерения), "
+            "json-массива или json lines, уже существующие пропускаются")
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="путь к файлу с ингредиентами")
+        parser.add_argument("--format", choices=READERS,
+                            help="формат файла, по умолчанию по расширению")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--no-copy", action="store_true",
+                            help="не использовать COPY на PostgreSQL")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or os.path.splitext(
+            options["path"]
+        )[1].lstrip(".").lower().replace("ndjson", "jsonl")
+        if file_format not in READERS:
+            raise CommandError(
+                f"Неизвестный формат файла: {file_format or '-'}"
+            )
+        use_copy = (connection.vendor == "postgresql"
+                    and not options["no_copy"])
+        load_batch = self.copy_batch if use_copy else self.insert_batch
+
+        counts = {"read": 0, "inserted": 0, "skipped": 0, "invalid": 0}
+        started = time.perf_counter()
+        with open(options["path"], encoding="utf-8") as file:
+            rows = READERS[file_format](file)
+            while True:
+                batch = list(islice(rows, options["batch_size"]))
+                if not batch:
+                    break
+                valid = [row for row in map(clean_row, batch) if row]
+                with transaction.atomic():
+                    inserted = load_batch(list(dict.fromkeys(valid)))
+                counts["read"] += len(batch)
+                counts["invalid"] += len(batch) - len(valid)
+                counts["inserted"] += inserted
+                counts["skipped"] += len(valid) - inserted
+
+        if counts["inserted"]:
+            bump_reference_version("ingredients")
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Прочитано: {counts['read']}, "
+            f"добавлено: {counts['inserted']}, "
+            f"пропущено: {counts['skipped']}, "
+            f"с ошибками: {counts['invalid']}, "
+            f"{counts['read'] / elapsed if elapsed else 0:.0f} строк/с"
+        ))
+
+    def existing(self, rows):
+        return set(Ingredient.objects.filter(
+            name__in={name for name, _ in rows}
+        ).values_list("name", "measurement_unit")) & set(rows)
+
+    def insert_batch(self, rows):
+        """уже существующие пары пропускает уникальный индекс, в том
+        числе добавленные параллельной загрузкой"""
+        existing = self.existing(rows)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=measurement_unit)
+             for name, measurement_unit in rows
+             if (name, measurement_unit) not in existing],
+            ignore_conflicts=True
+        )
+        return len(self.existing(rows)) - len(existing)
+
+    def copy_batch(self, rows):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        stream = io.StringIO()
+        csv.writer(stream).writerows(rows)
+        stream.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMPORARY TABLE IF NOT EXISTS ingredient_load "
+                "(name varchar(200), measurement_unit varchar(200)) "
+                "ON COMMIT DELETE ROWS"
+            )
+            cursor.copy_expert(
+                "COPY ingredient_load (name, measurement_unit) "
+                "FROM STDIN WITH (FORMAT csv)",
+                stream
+            )
+            cursor.execute(
+                f"INSERT INTO {table} (name, measurement_unit) "
+                f"SELECT DISTINCT load.name, load.measurement_unit "
+                f"FROM ingredient_load AS load "
+                f"ON CONFLICT (name, measurement_unit) DO NOTHING"
+            )
+            return cursor.rowcount
@@ -0,0 +1,125 @@
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from recipes.models import ImageTask, Recipe
+from api.images import process_recipe_image
+
+
+class Command(BaseCommand):
+    help = ("Обрабатывает очередь изображений рецептов: задачи берутся "
+            "в обработку короткой транзакцией, изображения обрабатываются "
+            "вне ее")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20)
+        parser.add_argument("--max-attempts", type=int, default=3)
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="не завершаться, а ждать новые задачи"
+        )
+        parser.add_argument("--sleep", type=float, default=5,
+                            help="пауза между проверками очереди, сек.")
+        parser.add_argument(
+            "--claim-timeout",
+            type=int,
+            default=600,
+            help="задачи в обработке дольше стольких секунд (обработчик "
+                 "завершился, не закончив их) берутся заново"
+        )
+        parser.add_argument(
+            "--backfill",
+            action="store_true",
+            help="сначала поставить в очередь рецепты с изображением "
+                 "без уменьшенных копий"
+        )
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            queued = self.backfill(options["batch_size"])
+            self.stdout.write(f"Поставлено в очередь: {queued}")
+
+        processed = failed = 0
+        while True:
+            tasks = self.claim(options)
+            for task in tasks:
+                if self.run_task(task, options["max_attempts"]):
+                    processed += 1
+                elif task.status == ImageTask.FAILED:
+                    failed += 1
+
+            if not tasks:
+                if not options["loop"]:
+                    break
+                time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано: {processed}, с ошибками: {failed}"
+        ))
+
+    def backfill(self, batch_size):
+        """ставит в очередь рецепты с изображением без уменьшенных копий,
+        для которых нет ожидающей задачи"""
+        recipes = Recipe.objects.exclude(
+            Q(image="") | Q(image__isnull=True)
+        ).filter(image_variants={}).exclude(
+            image_tasks__status__in=(ImageTask.PENDING, ImageTask.PROCESSING)
+        ).order_by("id").values_list("id", flat=True).iterator(
+            chunk_size=batch_size
+        )
+        queued = 0
+        while True:
+            recipes_id = list(islice(recipes, batch_size))
+            if not recipes_id:
+                return queued
+            ImageTask.objects.bulk_create([ImageTask(recipe_id=recipe_id)
+                                           for recipe_id in recipes_id])
+            queued += len(recipes_id)
+
+    def claim(self, options):
+        """отмечает пачку задач как обрабатываемые и сразу фиксирует
+        транзакцию, блокировки на время обработки не держатся"""
+        now = timezone.now()
+        stale = now - timedelta(seconds=options["claim_timeout"])
+        with transaction.atomic():
+            tasks = list(ImageTask.objects.select_for_update(
+                skip_locked=True, of=("self",)
+            ).filter(
+                Q(status=ImageTask.PENDING)
+                | Q(status=ImageTask.PROCESSING, started__lt=stale)
+            ).select_related("recipe")[:options["batch_size"]])
+            ImageTask.objects.filter(
+                id__in=[task.id for task in tasks]
+            ).update(status=ImageTask.PROCESSING, started=now)
+        return tasks
+
+    def run_task(self, task, max_attempts):
+        """задачи старше последней для того же рецепта пропускаются;
+        задача с ошибкой возвращается в очередь, пока не кончатся
+        попытки"""
+        task.attempts += 1
+        newer = ImageTask.objects.filter(recipe=task.recipe_id,
+                                         id__gt=task.id).exists()
+        try:
+            done = not newer and process_recipe_image(task.recipe)
+        except Exception as error:
+            task.error = str(error)
+            task.status = (ImageTask.FAILED if task.attempts >= max_attempts
+                           else ImageTask.PENDING)
+            self.save_task(task)
+            return False
+        task.status = ImageTask.DONE
+        self.save_task(task)
+        return done
+
+    def save_task(self, task):
+        """рецепт мог быть удален вместе с задачей во время обработки"""
+        ImageTask.objects.filter(pk=task.pk).update(
+            status=task.status, attempts=task.attempts, error=task.error
+        )
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import ShoppingCartIngredient, ShoppingCartRecipe
+from api.utils import calculate_shopping_lists
+
+
+class Command(BaseCommand):
+    help = ("Сверяет списки покупок пользователей с их корзинами "
+            "и пересобирает расхождения")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="только проверить списки покупок, ничего не изменяя"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="количество пользователей, обрабатываемых за один проход"
+        )
+
+    def handle(self, *args, **options):
+        users_id = sorted(
+            set(ShoppingCartRecipe.objects.values_list(
+                "user_id", flat=True
+            ).distinct())
+            | set(ShoppingCartIngredient.objects.values_list(
+                "user_id", flat=True
+            ).distinct())
+        )
+        batch_size = options["batch_size"]
+
+        drift_users = 0
+        for start in range(0, len(users_id), batch_size):
+            batch = users_id[start:start + batch_size]
+            with transaction.atomic():
+                expected = calculate_shopping_lists(batch)
+                stored = ShoppingCartIngredient.objects.select_for_update(
+                ).filter(user__in=batch)
+                actual = {(row.user_id, row.ingredient_id): row.amount
+                          for row in stored}
+                if actual == expected:
+                    continue
+
+                drift = {user_id for (user_id, _), _ in
+                         expected.items() ^ actual.items()}
+                drift_users += len(drift)
+                if options["verify"]:
+                    continue
+
+                ShoppingCartIngredient.objects.filter(
+                    user__in=drift
+                ).delete()
+                ShoppingCartIngredient.objects.bulk_create(
+                    [ShoppingCartIngredient(user_id=user_id,
+                                            ingredient_id=ingredient_id,
+                                            amount=amount)
+                     for (user_id, ingredient_id), amount
+                     in expected.items() if user_id in drift],
+                    batch_size=1000
+                )
+
+        if options["verify"] and drift_users:
+            raise CommandError(
+                f"Списки покупок расходятся с корзинами "
+                f"у {drift_users} пользователей"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Проверено пользователей: {len(users_id)}, "
+            f"исправлено: {0 if options['verify'] else drift_users}"
+        ))
@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import (FavoriteRecipe,
+                            Recipe,
+                            ShoppingCartRecipe,
+                            Subscribe,
+                            User)
+from recipes.queries import count_of
+
+# счетчик: (модель, в которой считаются строки, поле ссылки на объект)
+COUNTERS = {
+    Recipe: {
+        "favorites_count": (FavoriteRecipe, "recipe"),
+        "carts_count": (ShoppingCartRecipe, "recipe"),
+    },
+    User: {
+        "followers_count": (Subscribe, "following"),
+        "recipes_count": (Recipe, "author"),
+    },
+}
+
+
+class Command(BaseCommand):
+    help = ("Сверяет счетчики избранного, корзины, подписчиков и рецептов "
+            "с фактическим количеством записей и исправляет расхождения")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="только проверить счетчики, ничего не изменяя"
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="количество объектов, обрабатываемых за один проход"
+        )
+
+    def handle(self, *args, **options):
+        drift = 0
+        for model, counters in COUNTERS.items():
+            checked, fixed = self.recount(model, counters, options)
+            drift += fixed
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}: проверено {checked}, "
+                f"расхождений {fixed}"
+            )
+        if options["verify"] and drift:
+            raise CommandError(f"Счетчики расходятся у {drift} объектов")
+
+    def recount(self, model, counters, options):
+        """проходит объекты пачками по возрастанию id, каждая пачка
+        сверяется и исправляется в своей транзакции"""
+        fields = list(counters)
+        actual_fields = {f"actual_{field}": count_of(*source)
+                         for field, source in counters.items()}
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                rows = list(model.objects.select_for_update().filter(
+                    pk__gt=last_id
+                ).order_by("pk").annotate(**actual_fields).values(
+                    "pk", *fields, *actual_fields
+                )[:options["batch_size"]])
+                if not rows:
+                    break
+                last_id = rows[-1]["pk"]
+                checked += len(rows)
+                changed = [
+                    model(pk=row["pk"], **{field: row[f"actual_{field}"]
+                                           for field in fields})
+                    for row in rows
+                    if any(row[field] != row[f"actual_{field}"]
+                           for field in fields)
+                ]
+                fixed += len(changed)
+                if changed and not options["verify"]:
+                    model.objects.bulk_update(changed, fields)
+        return checked, fixed
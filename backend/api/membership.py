@@ -0,0 +1,80 @@
+import time
+from array import array
+
+from django.core.cache import caches
+from django.db import transaction
+
+from recipes.models import FavoriteRecipe, ShoppingCartRecipe, Subscribe
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+SUBSCRIPTIONS = 'subscriptions'
+
+SOURCES = {
+    FAVORITES: (FavoriteRecipe, 'recipe_id'),
+    SHOPPING_CART: (ShoppingCartRecipe, 'recipe_id'),
+    SUBSCRIPTIONS: (Subscribe, 'following_id'),
+}
+
+
+def membership_cache():
+    return caches['membership']
+
+
+def version_key(user_id, kind):
+    return f'membership-version:{kind}:{user_id}'
+
+
+def ids_key(user_id, kind, version):
+    return f'membership:{kind}:{user_id}:{version}'
+
+
+def get_version(user_id, kind):
+    cache = membership_cache()
+    key = version_key(user_id, kind)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns())
+        version = cache.get(key)
+    return version
+
+
+def get_membership(user, kind):
+    """возвращает множество id избранных рецептов, рецептов в корзине
+    или авторов, на которых подписан пользователь, множество хранится
+    в общем кэше компактным массивом и загружается из базы при промахе"""
+    cache = membership_cache()
+    version = get_version(user.id, kind)
+    key = ids_key(user.id, kind, version)
+    packed = cache.get(key)
+    if packed is None:
+        model, field = SOURCES[kind]
+        ids = model.objects.filter(user=user).values_list(field, flat=True)
+        packed = array('q', sorted(ids)).tobytes()
+        cache.set(key, packed)
+    return frozenset(array('q', packed))
+
+
+def change_membership(user_id, kind, object_id, added):
+    """после фиксации транзакции переводит множество пользователя на новую
+    версию, добавив или убрав object_id; если множества прошлой версии
+    нет в кэше, новая версия загрузится из базы при следующем чтении"""
+
+    def update():
+        cache = membership_cache()
+        try:
+            version = cache.incr(version_key(user_id, kind))
+        except ValueError:
+            return
+        packed = cache.get(ids_key(user_id, kind, version - 1))
+        if packed is None:
+            return
+        ids = set(array('q', packed))
+        if added:
+            ids.add(object_id)
+        else:
+            ids.discard(object_id)
+        cache.set(ids_key(user_id, kind, version),
+                  array('q', sorted(ids)).tobytes())
+
+    transaction.on_commit(update)
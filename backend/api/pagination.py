@@ -1,6 +1,180 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination,
+                                       CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_VERSION_KEY = 'pagination-count-version'
+
+
+def invalidate_page_counts():
+    """сбрасывает закэшированное количество объектов для всех списков"""
+    try:
+        cache.incr(COUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(COUNT_VERSION_KEY, 1, None)
+
+
+class CachedCountPaginator(Paginator):
+    """пагинатор, который кэширует количество объектов для одинаковых
+    запросов на PAGINATION_COUNT_CACHE_TTL секунд"""
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return len(self.object_list)
+        sql, params = self.object_list.query.sql_with_params()
+        version = cache.get_or_set(COUNT_VERSION_KEY, 1, None)
+        key = 'pagination-count:{}:{}'.format(
+            version,
+            hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TTL)
+        return count
+
+
+class KeysetPagination(BasePagination):
+    """постраничная навигация по ключу сортировки: курсор хранит значения
+    полей сортировки последнего объекта страницы и id, следующая страница
+    выбирается условием по ним без OFFSET и без подсчета количества"""
+    cursor_query_param = 'cursor'
+    page_size = 9
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор'
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by
+                        or queryset.model._meta.ordering)
+        if not {'id', '-id', 'pk', '-pk'} & set(ordering):
+            ordering.append('id')
+        return [(field.lstrip('-'), field.startswith('-'))
+                for field in ordering]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()))
+            return cursor['p'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': int(reverse)},
+                            default=str, ensure_ascii=False)
+        encoded = urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(self.base_url,
+                                   self.cursor_query_param, encoded)
+
+    def get_position(self, obj):
+        position = []
+        for field, _ in self.ordering:
+            value = obj
+            for attr in field.split('__'):
+                value = getattr(value, attr)
+            position.append(value)
+        return position
+
+    def position_filter(self, position, reverse):
+        condition = Q()
+        equal = Q()
+        for (field, descending), value in zip(self.ordering, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        position, reverse = self.decode_cursor(request)
+        if position is not None and len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        order_by = [('-' if descending != reverse else '') + field
+                    for field, descending in self.ordering]
+        queryset = queryset.order_by(*order_by)
+        if position is not None:
+            queryset = queryset.filter(
+                self.position_filter(position, reverse)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next = self.previous = None
+        if results:
+            if has_more or reverse:
+                self.next = self.encode_cursor(
+                    self.get_position(results[-1]), False
+                )
+            if position is not None and (has_more or not reverse):
+                self.previous = self.encode_cursor(
+                    self.get_position(results[0]), True
+                )
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.next,
+            'previous': self.previous,
+            'results': data,
+        })
 
 
 class CustomPagination(PageNumberPagination):
+    """постраничная навигация по номеру страницы, с параметром cursor
+    (для первой страницы пустым) - навигация по ключу сортировки,
+    списки, которые не являются queryset, - только по номеру страницы"""
     limit = 9
-    page_size_query_param = 'limit'
\ No newline at end of file
+    page_size_query_param = 'limit'
+    django_paginator_class = CachedCountPaginator
+    keyset_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if hasattr(queryset, 'query') and (
+                self.keyset_pagination_class.cursor_query_param
+                in request.query_params):
+            self.keyset = self.keyset_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FeedPagination(CursorPagination):
+    page_size = 9
+    page_size_query_param = 'limit'
+    ordering = '-id'
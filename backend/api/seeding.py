@@ -0,0 +1,190 @@
+import random
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.conf import settings
+
+from recipes.models import (FavoriteRecipe,
+                            FeedRecipe,
+                            Ingredient,
+                            IngredientRecipe,
+                            Recipe,
+                            ShoppingCartIngredient,
+                            ShoppingCartRecipe,
+                            Subscribe,
+                            Tag,
+                            TagRecipe,
+                            User)
+from .caching import bump_reference_version
+from .indexes import ingredient_index, pantry_index
+from .pagination import invalidate_page_counts
+
+BATCH_SIZE = 5000
+PREFIX = "seed"
+WORDS = ("картофель", "морковь", "курица", "говядина", "рис", "гречка",
+         "молоко", "сыр", "томаты", "лук", "чеснок", "перец", "суп",
+         "салат", "пирог", "запеканка", "соус", "жарить", "варить",
+         "запекать", "тушить", "нарезать", "смешать", "духовка")
+
+
+def created(model, objects, field):
+    """bulk_create без RETURNING (старый SQLite) не заполняет pk:
+    id дочитываются по полю field, при повторах берется последняя запись"""
+    if objects and objects[0].pk is None:
+        objects_id = dict(model.objects.filter(
+            **{f"{field}__in": [getattr(obj, field) for obj in objects]}
+        ).values_list(field, "id").order_by("id"))
+        for obj in objects:
+            obj.pk = objects_id[getattr(obj, field)]
+    return objects
+
+
+def existing_ingredients(objects):
+    """с ignore_conflicts pk не заполняется, а часть пар уже может
+    быть в базе: ингредиенты дочитываются по названию и единице"""
+    objects_id = {
+        (name, measurement_unit): pk
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            name__in={obj.name for obj in objects}
+        ).values_list("id", "name", "measurement_unit")
+    }
+    for obj in objects:
+        obj.pk = objects_id[(obj.name, obj.measurement_unit)]
+    return objects
+
+
+def seed_dataset(users, recipes, tags=10, ingredients=500,
+                 favorites=20, carts=5, subscriptions=10,
+                 ingredient_rows=None, seed=0):
+    """создает пользователей, тэги, ингредиенты и рецепты с избранным,
+    корзинами и подписками для проверок и замеров; favorites, carts и
+    subscriptions - количество на пользователя; ingredient_rows - пары
+    (название, единица измерения) для ингредиентов вместо генерируемых;
+    счетчики, ленты и списки покупок заполняются согласованно с записями;
+    возвращает созданных пользователей, тэги, ингредиенты и id рецептов"""
+    rand = random.Random(seed)
+    if ingredient_rows is None:
+        ingredient_rows = ((f"{PREFIX} {rand.choice(WORDS)} {number}",
+                            rand.choice(("г", "мл", "шт.")))
+                           for number in range(ingredients))
+
+    users = created(User, User.objects.bulk_create([
+        User(username=f"{PREFIX}{number}",
+             email=f"{PREFIX}{number}@example.com",
+             first_name="Seed",
+             last_name=str(number),
+             password="!")
+        for number in range(users)
+    ], batch_size=BATCH_SIZE), "username")
+    tags = created(Tag, Tag.objects.bulk_create([
+        Tag(name=f"{PREFIX}-tag-{number}",
+            slug=f"{PREFIX}-tag-{number}",
+            color="#{:06X}".format(rand.randrange(0x1000000)))
+        for number in range(tags)
+    ]), "slug")
+    ingredients = existing_ingredients(Ingredient.objects.bulk_create([
+        Ingredient(name=name, measurement_unit=measurement_unit)
+        for name, measurement_unit in islice(ingredient_rows, ingredients)
+    ], batch_size=BATCH_SIZE, ignore_conflicts=True))
+
+    # авторы выбираются неравномерно: у части пользователей много рецептов
+    authors = rand.choices(users, weights=[1 / (position + 1)
+                                           for position in range(len(users))],
+                           k=recipes)
+    favorite_pairs = [(user, number) for user in users
+                      for number in rand.sample(range(recipes),
+                                                min(favorites, recipes))]
+    cart_pairs = [(user, number) for user in users
+                  for number in rand.sample(range(recipes),
+                                            min(carts, recipes))]
+    favorites_count = Counter(number for _, number in favorite_pairs)
+    carts_count = Counter(number for _, number in cart_pairs)
+    recipes = created(Recipe, Recipe.objects.bulk_create([
+        Recipe(name=f"{PREFIX} {number} " + " ".join(rand.sample(WORDS, 3)),
+               text=" ".join(rand.choices(WORDS, k=30)),
+               cooking_time=rand.randint(1, 120),
+               author=author,
+               favorites_count=favorites_count[number],
+               carts_count=carts_count[number])
+        for number, author in enumerate(authors)
+    ], batch_size=BATCH_SIZE), "name")
+
+    TagRecipe.objects.bulk_create([
+        TagRecipe(tag=tag, recipe=recipe)
+        for recipe in recipes for tag in rand.sample(tags, rand.randint(1, 3))
+    ], batch_size=BATCH_SIZE)
+    amounts = {}
+    for recipe in recipes:
+        amounts[recipe.pk] = {ingredient.pk: rand.randint(1, 500)
+                              for ingredient in rand.sample(
+                                  ingredients, rand.randint(3, 10))}
+    IngredientRecipe.objects.bulk_create([
+        IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                         amount=amount)
+        for recipe_id, recipe_amounts in amounts.items()
+        for ingredient_id, amount in recipe_amounts.items()
+    ], batch_size=BATCH_SIZE)
+
+    FavoriteRecipe.objects.bulk_create([
+        FavoriteRecipe(user=user, recipe=recipes[number])
+        for user, number in favorite_pairs
+    ], batch_size=BATCH_SIZE)
+    ShoppingCartRecipe.objects.bulk_create([
+        ShoppingCartRecipe(user=user, recipe=recipes[number])
+        for user, number in cart_pairs
+    ], batch_size=BATCH_SIZE)
+    shopping_list = defaultdict(Counter)
+    for user, number in cart_pairs:
+        shopping_list[user.pk].update(amounts[recipes[number].pk])
+    ShoppingCartIngredient.objects.bulk_create([
+        ShoppingCartIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                               amount=amount)
+        for user_id, user_amounts in shopping_list.items()
+        for ingredient_id, amount in user_amounts.items()
+    ], batch_size=BATCH_SIZE)
+
+    following = []
+    for user in users:
+        authors_sample = rand.sample(users, min(subscriptions + 1, len(users)))
+        following += [(user, author) for author in authors_sample
+                      if author != user][:subscriptions]
+    Subscribe.objects.bulk_create([
+        Subscribe(user=user, following=author) for user, author in following
+    ], batch_size=BATCH_SIZE)
+    followers_count = Counter(author.pk for _, author in following)
+    # как fill_feed: в ленту попадают последние рецепты автора,
+    # рецепты популярных авторов в ленты не рассылаются
+    authored = defaultdict(list)
+    for recipe in recipes:
+        authored[recipe.author_id].append(recipe.pk)
+    FeedRecipe.objects.bulk_create([
+        FeedRecipe(user=user, recipe_id=recipe_id, author=author)
+        for user, author in following
+        if followers_count[author.pk] <= settings.FEED_FANOUT_THRESHOLD
+        for recipe_id in authored[author.pk][
+            -settings.FEED_BACKFILL_SIZE:]
+    ], batch_size=BATCH_SIZE)
+    recipes_count = Counter(author.pk for author in authors)
+    for user in users:
+        user.followers_count = followers_count[user.pk]
+        user.recipes_count = recipes_count[user.pk]
+    User.objects.bulk_update(users, ["followers_count", "recipes_count"],
+                             batch_size=BATCH_SIZE)
+
+    reset_caches()
+    return {
+        "users": users,
+        "tags": tags,
+        "ingredients": [ingredient.pk for ingredient in ingredients],
+        "recipes": [recipe.pk for recipe in recipes],
+    }
+
+
+def reset_caches():
+    """bulk_create не вызывает сигналы: кэши и индексы в памяти
+    сбрасываются после заполнения и после отката данных"""
+    invalidate_page_counts()
+    ingredient_index.invalidate()
+    pantry_index.invalidate()
+    bump_reference_version("tags")
+    bump_reference_version("ingredients")
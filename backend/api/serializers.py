@@ -1,3 +1,8 @@
+import json
+
+from django.conf import settings as django_settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
@@ -15,9 +20,29 @@ from recipes.models import (Ingredient,
                             Tag,
                             TagRecipe,
                             Subscribe)
+from .images import (delete_image_variants,
+                     enqueue_image_processing,
+                     image_srcset)
+from .indexes import pantry_index
+from .membership import (FAVORITES,
+                         SHOPPING_CART,
+                         SUBSCRIPTIONS,
+                         get_membership)
+from .timing import TimedSerializerMixin
+from .utils import change_counter, change_shopping_list, fan_out_recipe
+
+
+def get_recipes_flags(user):
+    """возвращает множества id рецептов в избранном и в корзине
+    пользователя и id авторов, на которых он подписан, из кэша"""
+    return {
+        "favorited": get_membership(user, FAVORITES),
+        "in_shopping_cart": get_membership(user, SHOPPING_CART),
+        "subscribed": get_membership(user, SUBSCRIPTIONS),
+    }
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     is_subscribed = serializers.SerializerMethodField()
 
@@ -37,8 +62,10 @@ class UserSerializer(serializers.ModelSerializer):
         request_user = self.context["request"].user
         if request_user.is_anonymous:
             return False
-        return Subscribe.objects.filter(user=request_user,
-                                        following=obj).exists()
+        subscribed = self.context.get("subscribed")
+        if subscribed is None:
+            subscribed = get_membership(request_user, SUBSCRIPTIONS)
+        return obj.id in subscribed
 
     def create(self, validated_data):
         """создание хэшируемого пароля"""
@@ -78,30 +105,45 @@ class CurrentPasswordSerializer(serializers.Serializer):
         self.fail("invalid_password")
 
 
-class SetPasswordSerializer(PasswordSerializer, CurrentPasswordSerializer):
+class SetPasswordSerializer(TimedSerializerMixin,
+                            PasswordSerializer,
+                            CurrentPasswordSerializer):
     pass
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         fields = '__all__'
         model = Tag
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         fields = '__all__'
         model = Ingredient
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    """сериализатор списка рецептов, перед выводом страницы получает
+    избранное, корзину и подписки текущего пользователя
+    и передает их в контекст"""
+
+    def to_representation(self, data):
+        request_user = self.context["request"].user
+        if not request_user.is_anonymous:
+            self.context.update(get_recipes_flags(request_user))
+        return super().to_representation(data)
+
+
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     tags = TagSerializer(many=True, source='tag', required=False)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    images = serializers.SerializerMethodField()
 
     class Meta:
         fields = (
@@ -113,13 +155,16 @@ class RecipeSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "images",
             "text",
-            "cooking_time"
+            "cooking_time",
+            "favorites_count"
         )
         model = Recipe
+        list_serializer_class = RecipeListSerializer
 
     def get_ingredients(self, obj):
-        ingredients = IngredientRecipe.objects.filter(recipe=obj.id)
+        ingredients = obj.ingredientrecipe_set.all()
         ingredient_list = []
         for ingredient in ingredients:
             ingredient_list.append(
@@ -132,15 +177,20 @@ class RecipeSerializer(serializers.ModelSerializer):
             )
         return ingredient_list
 
+    def get_images(self, obj):
+        """возвращает адреса уменьшенных копий изображения"""
+        return image_srcset(obj, self.context.get("request"))
+
     def get_is_favorited(self, obj):
         """возвращает в поле is_vaforite True если текущий пользователь
         отметил рецепт в избранное"""
         request_user = self.context["request"].user
         if request_user.is_anonymous:
             return False
-        return FavoriteRecipe.objects.filter(
-            user=request_user,
-            recipe=obj).exists()
+        favorited = self.context.get("favorited")
+        if favorited is None:
+            favorited = get_membership(request_user, FAVORITES)
+        return obj.id in favorited
 
     def get_is_in_shopping_cart(self, obj):
         """возвращает в поле is_in_shopping_cart True если текущий пользователь
@@ -148,9 +198,10 @@ class RecipeSerializer(serializers.ModelSerializer):
         request_user = self.context["request"].user
         if request_user.is_anonymous:
             return False
-        return ShoppingCartRecipe.objects.filter(
-            user=request_user,
-            recipe=obj).exists()
+        in_shopping_cart = self.context.get("in_shopping_cart")
+        if in_shopping_cart is None:
+            in_shopping_cart = get_membership(request_user, SHOPPING_CART)
+        return obj.id in in_shopping_cart
 
 
 # class IngredientAmountSerializers(serializers.Serializer):
@@ -163,6 +214,14 @@ class IngredientJSONField(serializers.Field):
         return value.all().values("id")
 
     def to_internal_value(self, data):
+        """в multipart-запросе ингредиенты передаются json-строкой"""
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"message": "Ингредиенты должны быть списком в json"}
+                )
         # raise serializers.ValidationError({"message": "Количество должно быть больше нуля"})      # здесь не работает в react
 
         # ingr_id = []
@@ -186,7 +245,27 @@ class IngredientJSONField(serializers.Field):
         return data
 
 
-class RecipeCreateSerializer(serializers.ModelSerializer):
+class RecipeImageField(Base64ImageField):
+    """изображение в base64 для json-запроса или файлом для multipart,
+    размер проверяется до декодирования"""
+
+    def to_internal_value(self, data):
+        max_size = django_settings.RECIPE_IMAGE_MAX_SIZE
+        if isinstance(data, UploadedFile):
+            if data.size > max_size:
+                raise serializers.ValidationError(
+                    f"Размер изображения больше {max_size} байт"
+                )
+            return serializers.ImageField.to_internal_value(self, data)
+        if isinstance(data, str) and len(data) * 3 // 4 > max_size:
+            raise serializers.ValidationError(
+                f"Размер изображения больше {max_size} байт"
+            )
+        return super().to_internal_value(data)
+
+
+class RecipeCreateSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
         queryset=Tag.objects.all(),
         many=True,
@@ -195,7 +274,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     )
     # ingredients = IngredientAmountSerializers(required=True, source='ingredient', many=True)
     ingredients = IngredientJSONField(required=True, source='ingredient')
-    image = Base64ImageField(required=False)
+    image = RecipeImageField(required=False)
 
     class Meta:
         fields = (
@@ -213,12 +292,31 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         обновления рецепта"""
         return [TagRecipe(tag=tag, recipe=recipe) for tag in tags]
 
-    def list_for_ingredients(self, recipe, ingredients):
+    def get_ingredients(self, ingredients):
+        """возвращает словарь {id: ингредиент} одним запросом,
+        если каких-то ингредиентов нет - ошибка со всеми их id"""
+        ingredients_id = [ingredient['id'] for ingredient in ingredients]
+        found = Ingredient.objects.in_bulk([
+            int(ingredient_id) for ingredient_id in ingredients_id
+            if str(ingredient_id).isdigit()
+        ])
+        unknown = [str(ingredient_id) for ingredient_id in ingredients_id
+                   if not str(ingredient_id).isdigit()
+                   or int(ingredient_id) not in found]
+        if unknown:
+            raise serializers.ValidationError(
+                {"message": f"Ингредиенты не найдены: {', '.join(unknown)}"}
+            )
+        return found
+
+    def list_for_ingredients(self, recipe, ingredients, found=None):
         """возвращает список ингредиентов для создания или
-        обновления рецепта"""
+        обновления рецепта, found - уже найденные ингредиенты"""
+        if found is None:
+            found = self.get_ingredients(ingredients)
         return [IngredientRecipe(
             recipe=recipe,
-            ingredient=get_object_or_404(Ingredient, id=ingredient['id']),
+            ingredient=found[int(ingredient['id'])],
             amount=ingredient['amount']
         ) for ingredient in ingredients]
 
@@ -230,9 +328,14 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         ingredients_id = []
 
         for ingredient in ingredients:
-            ingredients_id.append(ingredient["id"])
+            ingredient_id = str(ingredient["id"])
+            ingredients_id.append(
+                int(ingredient_id) if ingredient_id.isdigit()
+                else ingredient_id
+            )
 
-            if not ingredient["amount"].isnumeric() or int(ingredient["amount"]) <= 0:
+            amount = str(ingredient["amount"])
+            if not amount.isnumeric() or int(amount) <= 0:
                 raise serializers.ValidationError(
                     {"message": "Количество должно быть числом больше нуля"}
                 )
@@ -242,7 +345,9 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 {"message": "Одинаковых ингредиентов не должно быть"}
             )
 
+    @transaction.atomic
     def create(self, data):
+        """рецепт, тэги и ингредиенты записываются в одной транзакции"""
         try:
             tags = data.pop('tag')
         except:
@@ -264,49 +369,143 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         IngredientRecipe.objects.bulk_create(
             self.list_for_ingredients(recipe, ingredients)
         )
+        pantry_index.add_ingredients(
+            recipe.id, [int(ingredient['id']) for ingredient in ingredients]
+        )
+        change_counter(User, recipe.author_id, 'recipes_count', 1)
+        fan_out_recipe(recipe)
+        enqueue_image_processing(recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, data):
-        instance.image = data.get('image', instance.image)
-        instance.name = data.get('name', instance.name)
-        instance.text = data.get('text', instance.text)
-        instance.cooking_time = data.get('cooking_time', instance.cooking_time)
-        instance.save()
-
-        """удаление страых тэгов и рецептов"""
-        TagRecipe.objects.filter(recipe=instance).delete()
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-
-        """получение новых тэгов и рецептов и сохранение 
-        их для измененного рецепта"""
+        """изменяет только то, что поменялось: поля рецепта, добавленные
+        и удаленные тэги и ингредиенты, количество ингредиентов;
+        рецепт блокируется на время изменения и сравнивается
+        с заблокированной записью; ингредиенты проверяются до записи"""
+        instance = Recipe.objects.select_for_update().get(pk=instance.pk)
         ingredients = data.get('ingredient')
+        if ingredients is not None:
+            self.chek_ingredients(ingredients)
+            found = self.get_ingredients(ingredients)
+
+        update_fields = [field for field in ('name', 'text', 'cooking_time')
+                         if field in data
+                         and data[field] != getattr(instance, field)]
+        for field in update_fields:
+            setattr(instance, field, data[field])
+        if 'image' in data:
+            delete_image_variants(instance)
+            instance.image = data['image']
+            instance.image_variants = {}
+            update_fields += ['image', 'image_variants']
+        if update_fields:
+            instance.save(update_fields=update_fields)
+        if 'image' in data:
+            enqueue_image_processing(instance)
+
         tags = data.get('tag')
+        if tags is not None:
+            self.update_tags(instance, tags)
 
-        TagRecipe.objects.bulk_create(self.list_for_tags(instance, tags))
-        IngredientRecipe.objects.bulk_create(
-            self.list_for_ingredients(instance, ingredients)
-        )
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients, found)
         return instance
 
+    def update_tags(self, recipe, tags):
+        """добавляет новые и удаляет убранные тэги рецепта"""
+        old_tags = set(TagRecipe.objects.filter(
+            recipe=recipe
+        ).values_list('tag_id', flat=True).order_by())
+        new_tags = {tag.id: tag for tag in tags}
+        removed = old_tags - new_tags.keys()
+        if removed:
+            TagRecipe.objects.filter(recipe=recipe,
+                                     tag_id__in=removed).delete()
+        added = [new_tags[tag_id] for tag_id in new_tags.keys() - old_tags]
+        if added:
+            TagRecipe.objects.bulk_create(self.list_for_tags(recipe, added))
+
+    def update_ingredients(self, recipe, ingredients, found):
+        """добавляет, удаляет и изменяет количество только тех
+        ингредиентов, которые поменялись, и обновляет списки покупок
+        у пользователей, у которых рецепт в корзине"""
+        old_rows = {row.ingredient_id: row for row
+                    in IngredientRecipe.objects.filter(
+                        recipe=recipe
+                    ).order_by()}
+        old_amounts = {ingredient_id: row.amount
+                       for ingredient_id, row in old_rows.items()}
+        new_amounts = {int(ingredient['id']): int(ingredient['amount'])
+                       for ingredient in ingredients}
+
+        removed = old_rows.keys() - new_amounts.keys()
+        if removed:
+            IngredientRecipe.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+            pantry_index.remove_ingredients(recipe.id, removed)
+        added = [ingredient for ingredient in ingredients
+                 if int(ingredient['id']) not in old_rows]
+        if added:
+            IngredientRecipe.objects.bulk_create(
+                self.list_for_ingredients(recipe, added, found)
+            )
+            pantry_index.add_ingredients(
+                recipe.id, [int(ingredient['id']) for ingredient in added]
+            )
+        changed = []
+        for ingredient_id, row in old_rows.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed.append(row)
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+
+        change_shopping_list(
+            recipe.cart.values_list("user_id", flat=True),
+            {ingredient_id: (new_amounts.get(ingredient_id, 0)
+                             - old_amounts.get(ingredient_id, 0))
+             for ingredient_id in old_amounts.keys() | new_amounts.keys()}
+        )
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """рецепт при подборе по продуктам с количеством
+    недостающих ингредиентов"""
+    missing_ingredients = serializers.IntegerField(read_only=True)
 
-class RecipeSubscribeSerializer(serializers.ModelSerializer):
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ("missing_ingredients",)
+
+
+class RecipeSubscribeSerializer(TimedSerializerMixin,
+                                serializers.ModelSerializer):
     """сериализатор для вывода рецептов при получении списка подписчиков"""
+    images = serializers.SerializerMethodField()
+
     class Meta:
         fields = (
             "id",
             "name",
             "image",
+            "images",
             "cooking_time"
         )
         model = Recipe
 
+    def get_images(self, obj):
+        return image_srcset(obj, self.context.get("request"))
+
 
-class SubscriptionUserSerializer(serializers.ModelSerializer):
+class SubscriptionUserSerializer(TimedSerializerMixin,
+                                 serializers.ModelSerializer):
     """сериализатор для вывода юзеров
     на которых подписан текущий пользователь"""
     is_subscribed = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(source='recipes.count')
-    recipes = RecipeSubscribeSerializer(many=True)
+    recipes_count = serializers.IntegerField(read_only=True)
+    recipes = RecipeSubscribeSerializer(many=True, source='page_recipes')
 
     class Meta:
         fields = ("email",
@@ -323,7 +522,7 @@ class SubscriptionUserSerializer(serializers.ModelSerializer):
         return True
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
+class SubscribeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """сериализатор для подписки на юзера"""
     user = UserSerializer(read_only=True)
     following = UserSerializer(read_only=True)
@@ -351,7 +550,8 @@ class SubscribeSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeFavoriteSerializer(serializers.ModelSerializer):
+class RecipeFavoriteSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     """сериализатор для добавления рецепта в избранное"""
     user = UserSerializer(read_only=True)
     recipe = RecipeSerializer(read_only=True)
@@ -376,7 +576,8 @@ class RecipeFavoriteSerializer(serializers.ModelSerializer):
         return data
 
 
-class RecipeShoppingCartSerializer(serializers.ModelSerializer):
+class RecipeShoppingCartSerializer(TimedSerializerMixin,
+                                   serializers.ModelSerializer):
     """сериализатор для добавления рецепта в корзину"""
     user = UserSerializer(read_only=True)
     recipe = RecipeSerializer(read_only=True)
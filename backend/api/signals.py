@@ -0,0 +1,66 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from recipes.models import (FavoriteRecipe,
+                            Ingredient,
+                            IngredientRecipe,
+                            Recipe,
+                            ShoppingCartRecipe,
+                            Subscribe,
+                            Tag,
+                            TagRecipe,
+                            User)
+from recipes.search import repair_search
+from .caching import bump_reference_version
+from .indexes import ingredient_index, pantry_index
+from .pagination import invalidate_page_counts
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """сбрасывает индекс и готовый список ингредиентов
+    при изменении ингредиентов"""
+    ingredient_index.invalidate()
+    bump_reference_version("ingredients")
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_pantry_index(sender, instance, **kwargs):
+    """убирает удаленный рецепт из индекса подбора по продуктам"""
+    pantry_index.remove_ingredients(instance.id)
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def invalidate_pantry_index(sender, **kwargs):
+    """ингредиенты, измененные не через api (например в админке),
+    попадают в индекс подбора по продуктам при его перестроении"""
+    pantry_index.invalidate()
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags_list(sender, **kwargs):
+    """сбрасывает готовый список тэгов при изменении тэгов"""
+    bump_reference_version("tags")
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=TagRecipe)
+@receiver([post_save, post_delete], sender=FavoriteRecipe)
+@receiver([post_save, post_delete], sender=ShoppingCartRecipe)
+@receiver([post_save, post_delete], sender=Subscribe)
+@receiver([post_save, post_delete], sender=User)
+def invalidate_pagination_counts(sender, created=True, **kwargs):
+    """сбрасывает кэш количества объектов в списках при добавлении и
+    удалении записей; изменение записи (например last_login при каждом
+    входе) количество не меняет, поиск по измененному рецепту
+    обновится через PAGINATION_COUNT_CACHE_TTL"""
+    if created:
+        invalidate_page_counts()
+
+
+@receiver(post_migrate)
+def repair_recipe_search(sender, using, **kwargs):
+    """восстанавливает поисковый индекс рецептов после миграций"""
+    if sender.name == "recipes":
+        repair_search(connections[using])
@@ -0,0 +1,313 @@
+import io
+import tempfile
+import time
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.management.commands.explain_queries import (CHECKS,
+                                                     Command,
+                                                     check_context,
+                                                     main_query)
+from api.pagination import COUNT_VERSION_KEY
+from api.seeding import seed_dataset
+from recipes.models import Ingredient, Recipe, Subscribe, User
+
+IMAGE_VARIANTS = {
+    "thumbnail": {"width": 160, "height": 120,
+                  "webp": "recipes/variants/1-thumbnail.webp",
+                  "jpeg": "recipes/variants/1-thumbnail.jpeg"},
+}
+
+
+class QueriesCountMixin:
+
+    def count_queries(self, url):
+        """запросы к базе второго одинакового запроса: первый
+        заполняет кэши"""
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+
+class RecipeQueriesTest(QueriesCountMixin, TestCase):
+    """количество запросов списка рецептов не зависит от размера
+    страницы, рецепт отдается фиксированным числом запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_dataset(5, 40, tags=4, ingredients=30,
+                            favorites=15, carts=10, subscriptions=2)
+        cls.user = data["users"][0]
+        cls.recipe_id = data["recipes"][0]
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+
+    def assertListQueriesFlat(self):
+        counts = {}
+        for limit in (3, 9, 30):
+            counts[limit], data = self.count_queries(
+                f"/api/recipes/?limit={limit}"
+            )
+            self.assertEqual(len(data["results"]), limit)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_list_queries_do_not_grow_with_limit(self):
+        self.assertListQueriesFlat()
+
+    def test_authenticated_list_queries_do_not_grow_with_limit(self):
+        self.client.force_authenticate(self.user)
+        self.assertListQueriesFlat()
+
+    def test_retrieve_queries(self):
+        self.client.force_authenticate(self.user)
+        queries, data = self.count_queries(f"/api/recipes/{self.recipe_id}/")
+        self.assertEqual(data["id"], self.recipe_id)
+        self.assertEqual(queries, 3)
+
+
+class RecipeUpdateTest(TestCase):
+    """некорректные ингредиенты при изменении рецепта - ошибка 400,
+    рецепт не меняется"""
+
+    def setUp(self):
+        data = seed_dataset(2, 1, tags=3, ingredients=12,
+                            favorites=0, carts=0, subscriptions=0)
+        self.recipe = Recipe.objects.get(pk=data["recipes"][0])
+        self.client = APIClient()
+        self.client.force_authenticate(self.recipe.author)
+        self.url = f"/api/recipes/{self.recipe.pk}/"
+        self.amounts = self.ingredient_amounts()
+
+    def ingredient_amounts(self):
+        return set(self.recipe.ingredientrecipe_set.values_list(
+            "ingredient_id", "amount"
+        ))
+
+    def test_invalid_ingredient_id(self):
+        for ingredient_id in ("abc", 10 ** 9):
+            with self.subTest(ingredient_id):
+                response = self.client.patch(self.url, {
+                    "name": "новое имя",
+                    "ingredients": [{"id": ingredient_id, "amount": 5}],
+                }, format="json")
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("message", response.json())
+                self.recipe.refresh_from_db()
+                self.assertNotEqual(self.recipe.name, "новое имя")
+                self.assertEqual(self.ingredient_amounts(), self.amounts)
+
+    def test_duplicate_ingredient_id(self):
+        ingredient_id, _ = next(iter(self.amounts))
+        response = self.client.patch(self.url, {
+            "ingredients": [{"id": ingredient_id, "amount": 5},
+                            {"id": str(ingredient_id), "amount": 6}],
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.ingredient_amounts(), self.amounts)
+
+
+class SubscriptionsQueriesTest(QueriesCountMixin, TestCase):
+    """количество запросов страницы подписок не зависит от количества
+    авторов, recipes_limit и изображений рецептов"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="pass"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_authors(self, count, recipes=5):
+        start = User.objects.count()
+        for number in range(start, start + count):
+            author = User.objects.create_user(
+                username=f"author{number}",
+                email=f"author{number}@example.com",
+                password="pass"
+            )
+            Recipe.objects.bulk_create([
+                Recipe(name=f"recipe {number} {position}", text="text",
+                       cooking_time=10, author=author,
+                       image=f"recipes/{number}-{position}.jpg",
+                       image_variants=IMAGE_VARIANTS)
+                for position in range(recipes)
+            ])
+            Subscribe.objects.create(user=self.user, following=author)
+
+    def test_queries_do_not_grow_with_authors_and_limit(self):
+        self.add_authors(3, recipes=6)
+        counts = {}
+        for limit in (2, 5):
+            counts[(3, limit)], data = self.count_queries(
+                f"/api/users/subscriptions/?recipes_limit={limit}"
+            )
+            self.assertEqual({len(author["recipes"])
+                              for author in data["results"]}, {limit})
+        self.add_authors(5, recipes=6)
+        for limit in (2, 5):
+            counts[(8, limit)], data = self.count_queries(
+                f"/api/users/subscriptions/?recipes_limit={limit}"
+            )
+            self.assertEqual(len(data["results"]), 8)
+        self.assertEqual(len(set(counts.values())), 1, counts)
+
+    def test_queries_do_not_grow_with_images(self):
+        self.add_authors(4)
+        queries, data = self.count_queries(
+            "/api/users/subscriptions/?recipes_limit=3"
+        )
+        self.assertEqual(queries, 2)
+        for author in data["results"]:
+            self.assertEqual(len(author["recipes"]), 3)
+            for recipe in author["recipes"]:
+                self.assertIn("thumbnail", recipe["images"])
+
+
+class PageCountsInvalidationTest(TestCase):
+    """кэш количества объектов в списках сбрасывается при добавлении
+    и удалении пользователей, но не при входе"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.user = User.objects.create_user(
+            username="reader", email="reader@example.com", password="pass"
+        )
+
+    def count_version(self):
+        return caches["default"].get_or_set(COUNT_VERSION_KEY, 1, None)
+
+    def test_login_keeps_page_counts(self):
+        version = self.count_version()
+        response = self.client.post("/api/auth/token/login/", {
+            "email": "reader@example.com", "password": "pass"
+        })
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertEqual(self.count_version(), version)
+
+    def test_created_and_deleted_users_reset_page_counts(self):
+        version = self.count_version()
+        other = User.objects.create_user(
+            username="other", email="other@example.com", password="pass"
+        )
+        self.assertNotEqual(self.count_version(), version)
+        version = self.count_version()
+        other.delete()
+        self.assertNotEqual(self.count_version(), version)
+
+
+class ReferenceCacheTest(TestCase):
+    """готовый список ингредиентов обновляется, когда записи меняет
+    другой процесс без сигналов и без общего кэша"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        Ingredient.objects.create(name="соль", measurement_unit="г")
+
+    def names(self):
+        return [ingredient["name"]
+                for ingredient in self.client.get("/api/ingredients/").json()]
+
+    def test_cached_list_does_not_query_database(self):
+        self.names()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/ingredients/")
+            etag = response["ETag"]
+            not_modified = self.client.get("/api/ingredients/",
+                                           HTTP_IF_NONE_MATCH=etag)
+            captured = len(queries)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(captured, 0)
+
+    def test_inserted_rows_are_visible(self):
+        self.assertEqual(self.names(), ["соль"])
+        Ingredient.objects.create(name="сахар", measurement_unit="г")
+        self.assertEqual(self.names(), ["сахар", "соль"])
+
+    def test_loaded_rows_are_visible(self):
+        self.assertEqual(self.names(), ["соль"])
+        with tempfile.NamedTemporaryFile("w", suffix=".csv",
+                                         encoding="utf-8") as file:
+            file.write("сахар,г\nсоль,г\n")
+            file.flush()
+            call_command("load_ingredients", file.name, stdout=io.StringIO())
+        self.assertEqual(self.names(), ["сахар", "соль"])
+
+    def test_changed_rows_are_visible_after_ttl(self):
+        self.assertEqual(self.names(), ["соль"])
+        Ingredient.objects.update(name="перец")
+        self.assertEqual(self.names(), ["соль"])
+        later = time.monotonic() + settings.REFERENCE_CACHE_TTL + 1
+        with mock.patch("api.caching.time.monotonic", return_value=later):
+            self.assertEqual(self.names(), ["перец"])
+
+
+@skipUnless(connection.vendor in ("sqlite", "postgresql"),
+            "разбор плана EXPLAIN есть только для SQLite и PostgreSQL")
+class HotPathPlansTest(TestCase):
+    """основные запросы эндпоинтов из explain_queries не читают большие
+    таблицы полным просмотром, списки рецептов используют составные
+    индексы"""
+    max_rows = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        data = seed_dataset(30, 600, ingredients=50)
+        cls.user = data["users"][0]
+        cls.context = check_context(data)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.command = Command()
+        if connection.vendor == "postgresql":
+            # на маленькой таблице планировщик предпочел бы полный просмотр
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def plan(self, url, table):
+        response, sql = main_query(self.client, url.format(**self.context),
+                                   table)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(sql)
+        return sql
+
+    def test_checks_do_not_scan_large_tables(self):
+        for name, url, table in CHECKS:
+            with self.subTest(name):
+                plan, large = self.command.large_scans(
+                    self.plan(url, table), self.max_rows
+                )
+                self.assertEqual(large, {}, plan)
+
+    def test_recipe_lists_use_composite_indexes(self):
+        for url, index in (
+                ("/api/recipes/?author={author}", "recipe_author_name_idx"),
+                ("/api/recipes/?tags={tag}&tags={other_tag}",
+                 "tag_recipe_recipe_idx")):
+            with self.subTest(url):
+                plan, _ = self.command.explain(
+                    self.plan(url, "recipes_recipe")
+                )
+                self.assertIn(index, plan)
@@ -0,0 +1,137 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.fields import empty
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("db", "auth", "serialize", "render")
+
+# замеры текущего запроса, None - запрос не попал в выборку
+current_timings = ContextVar("current_timings", default=None)
+
+
+class RequestTimings:
+    """время этапов запроса в миллисекундах и количество запросов
+    к базе; этапы могут пересекаться: запросы к базе во время вывода
+    сериализатором входят и в db, и в serialize"""
+
+    def __init__(self):
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.queries = 0
+        self.active = set()
+
+    @contextmanager
+    def measure(self, stage):
+        """вложенный замер того же этапа не считается второй раз"""
+        if stage in self.active:
+            yield
+            return
+        self.active.add(stage)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[stage] += (time.perf_counter() - started) * 1000
+            self.active.discard(stage)
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        self.queries += 1
+        with self.measure("db"):
+            return execute(sql, params, many, context)
+
+    def header(self, total):
+        metrics = [f'db;dur={self.durations["db"]:.1f};'
+                   f'desc="{self.queries} queries"']
+        metrics += [f"{stage};dur={self.durations[stage]:.1f}"
+                    for stage in STAGES[1:]]
+        metrics.append(f"total;dur={total:.1f}")
+        return ", ".join(metrics)
+
+
+def measured(stage, method, *args, **kwargs):
+    """вызывает method, засчитывая время в stage, если запрос
+    попал в выборку"""
+    timings = current_timings.get()
+    if timings is None:
+        return method(*args, **kwargs)
+    with timings.measure(stage):
+        return method(*args, **kwargs)
+
+
+class ServerTimingMiddleware:
+    """для доли запросов SERVER_TIMING_SAMPLE_RATE замеряет время и
+    количество запросов к базе, аутентификации, сериализаторов и
+    рендеринга, отдает их в заголовке Server-Timing и пишет строкой json
+    в лог api.timing; ответ потоком замеряется до начала отдачи тела,
+    остальные запросы проходят без замеров"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(timings.execute_wrapper)
+                    )
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        total = (time.perf_counter() - started) * 1000
+
+        if settings.SERVER_TIMING_HEADER:
+            response["Server-Timing"] = timings.header(total)
+        logger.info(json.dumps({
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total, 1),
+            "queries": timings.queries,
+            **{f"{stage}_ms": round(duration, 1)
+               for stage, duration in timings.durations.items()},
+        }))
+        return response
+
+
+class TimedTokenAuthentication(TokenAuthentication):
+    def authenticate(self, request):
+        return measured("auth", super().authenticate, request)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return measured("render", super().render, data,
+                        accepted_media_type, renderer_context)
+
+
+class TimedBrowsableAPIRenderer(BrowsableAPIRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return measured("render", super().render, data,
+                        accepted_media_type, renderer_context)
+
+
+class TimedSerializerMixin:
+    """проверка входных данных и вывод сериализатором засчитываются
+    в этап serialize, вложенные сериализаторы второй раз не считаются"""
+
+    def to_representation(self, instance):
+        return measured("serialize", super().to_representation, instance)
+
+    def run_validation(self, data=empty):
+        return measured("serialize", super().run_validation, data)
@@ -0,0 +1,258 @@
+import json
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from recipes.models import (ImageTask,
+                            Ingredient,
+                            IngredientRecipe,
+                            Recipe,
+                            Tag,
+                            TagRecipe,
+                            User)
+from .indexes import pantry_index
+from .pagination import invalidate_page_counts
+from .utils import change_counter
+
+MAX_LENGTH = 200
+
+
+def export_recipes(chunk_size):
+    """генератор возвращает рецепты построчно в json lines; рецепты
+    читаются курсором пачками по chunk_size, тэги и ингредиенты
+    догружаются одним запросом на пачку, поэтому память не растет
+    с количеством рецептов; тэги, ингредиенты и автор выгружаются
+    по slug, названию и username, чтобы не зависеть от id в базе"""
+    recipes = Recipe.objects.order_by("id").values(
+        "id", "name", "text", "cooking_time", "image", "author__username"
+    ).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(recipes, chunk_size))
+        if not chunk:
+            break
+        recipes_id = [recipe["id"] for recipe in chunk]
+
+        tags = defaultdict(list)
+        for recipe_id, slug in TagRecipe.objects.filter(
+                recipe__in=recipes_id
+        ).values_list("recipe_id", "tag__slug").order_by():
+            tags[recipe_id].append(slug)
+
+        ingredients = defaultdict(list)
+        for recipe_id, name, measurement_unit, amount in (
+                IngredientRecipe.objects.filter(
+                    recipe__in=recipes_id
+                ).values_list(
+                    "recipe_id", "ingredient__name",
+                    "ingredient__measurement_unit", "amount"
+                ).order_by("id")):
+            ingredients[recipe_id].append({
+                "name": name,
+                "measurement_unit": measurement_unit,
+                "amount": amount,
+            })
+
+        yield "".join(json.dumps({
+            "name": recipe["name"],
+            "text": recipe["text"],
+            "cooking_time": recipe["cooking_time"],
+            "image": recipe["image"] or None,
+            "author": recipe["author__username"],
+            "tags": tags[recipe["id"]],
+            "ingredients": ingredients[recipe["id"]],
+        }, ensure_ascii=False) + "\n" for recipe in chunk)
+
+
+def parse_name(data):
+    name = data.get("name")
+    if not isinstance(name, str) or not name.strip() or (
+            len(name) > MAX_LENGTH):
+        raise ValueError("Не указано или слишком длинное имя рецепта")
+    return name
+
+
+def parse_text(data):
+    text = data.get("text")
+    if not isinstance(text, str):
+        raise ValueError("Не указано описание рецепта")
+    return text
+
+
+def parse_cooking_time(data):
+    cooking_time = data.get("cooking_time")
+    if not isinstance(cooking_time, int) or cooking_time < 1:
+        raise ValueError("Время приготовления должно быть числом больше нуля")
+    return cooking_time
+
+
+def parse_tags(data):
+    tags = data.get("tags")
+    if not tags or not isinstance(tags, list) or not all(
+            isinstance(slug, str) for slug in tags):
+        raise ValueError("Назначьте тэги для рецепта")
+    return set(tags)
+
+
+def parse_ingredients(data):
+    """количества по парам (название, единица измерения)"""
+    ingredients = data.get("ingredients")
+    if not ingredients or not isinstance(ingredients, list):
+        raise ValueError("Добавьте ингредиенты для рецепта")
+    amounts = {}
+    for ingredient in ingredients:
+        if not isinstance(ingredient, dict):
+            raise ValueError("Ингредиент должен быть json-объектом")
+        amount = ingredient.get("amount")
+        if not isinstance(amount, int) or amount <= 0:
+            raise ValueError("Количество должно быть числом больше нуля")
+        key = (ingredient.get("name"), ingredient.get("measurement_unit"))
+        if key in amounts:
+            raise ValueError("Одинаковых ингредиентов не должно быть")
+        amounts[key] = amount
+    return amounts
+
+
+def parse_line(line):
+    """проверяет строку json lines и возвращает словарь рецепта,
+    при ошибке - ValueError с описанием"""
+    try:
+        data = json.loads(line)
+    except ValueError:
+        raise ValueError("Некорректный json")
+    if not isinstance(data, dict):
+        raise ValueError("Рецепт должен быть json-объектом")
+
+    return {
+        "name": parse_name(data),
+        "text": parse_text(data),
+        "cooking_time": parse_cooking_time(data),
+        "image": data.get("image") or None,
+        "author": data.get("author"),
+        "tags": parse_tags(data),
+        "ingredients": parse_ingredients(data),
+    }
+
+
+def import_batch(records, default_author):
+    """записывает пачку проверенных рецептов, возвращает количество
+    созданных рецептов и список ошибок [(номер строки, сообщение)]"""
+    authors = User.objects.in_bulk(
+        {record["author"] for _, record in records if record["author"]},
+        field_name="username"
+    )
+    tags = Tag.objects.in_bulk(
+        {slug for _, record in records for slug in record["tags"]},
+        field_name="slug"
+    )
+    ingredients = {}
+    for ingredient_id, name, measurement_unit in Ingredient.objects.filter(
+            name__in={name for _, record in records
+                      for name, _ in record["ingredients"]}
+    ).values_list("id", "name", "measurement_unit").order_by("-id"):
+        ingredients[(name, measurement_unit)] = ingredient_id
+    names = set(Recipe.objects.filter(
+        name__in=[record["name"] for _, record in records]
+    ).values_list("name", flat=True))
+
+    errors = []
+    created = []
+    for number, record in records:
+        if record["name"] in names:
+            errors.append((number, "Рецепт с таким именем уже существует"))
+            continue
+        author = (authors.get(record["author"]) if record["author"]
+                  else default_author)
+        if author is None:
+            errors.append(
+                (number, f"Автор не найден: {record['author']}")
+            )
+            continue
+        unknown = sorted(record["tags"] - tags.keys())
+        if unknown:
+            errors.append(
+                (number, f"Тэги не найдены: {', '.join(unknown)}")
+            )
+            continue
+        unknown = [f"{name} ({measurement_unit})"
+                   for name, measurement_unit in record["ingredients"]
+                   if (name, measurement_unit) not in ingredients]
+        if unknown:
+            errors.append(
+                (number, f"Ингредиенты не найдены: {', '.join(unknown)}")
+            )
+            continue
+        names.add(record["name"])
+        created.append((Recipe(
+            name=record["name"],
+            text=record["text"],
+            cooking_time=record["cooking_time"],
+            image=record["image"],
+            author=author
+        ), record))
+
+    recipes = [recipe for recipe, _ in created]
+    Recipe.objects.bulk_create(recipes)
+    if recipes and recipes[0].pk is None:
+        recipes_id = dict(Recipe.objects.filter(
+            name__in=[recipe.name for recipe in recipes]
+        ).values_list("name", "id"))
+        for recipe in recipes:
+            recipe.pk = recipes_id[recipe.name]
+
+    TagRecipe.objects.bulk_create([
+        TagRecipe(tag=tags[slug], recipe=recipe)
+        for recipe, record in created for slug in record["tags"]
+    ])
+    IngredientRecipe.objects.bulk_create([
+        IngredientRecipe(ingredient_id=ingredients[key],
+                         amount=amount,
+                         recipe=recipe)
+        for recipe, record in created
+        for key, amount in record["ingredients"].items()
+    ])
+    ImageTask.objects.bulk_create([ImageTask(recipe=recipe)
+                                   for recipe in recipes if recipe.image])
+    for author_id, count in Counter(
+            recipe.author_id for recipe in recipes).items():
+        change_counter(User, author_id, "recipes_count", count)
+    return len(recipes), errors
+
+
+def import_recipes(lines, default_author, batch_size):
+    """загружает рецепты из json lines пачками по batch_size строк,
+    каждая пачка записывается в своей транзакции; рецепт без автора
+    получает автора default_author; возвращает количество созданных
+    рецептов и ошибки с номерами строк"""
+    result = {"created": 0, "errors": []}
+    numbered = ((number, line) for number, line in enumerate(lines, 1)
+                if line.strip())
+    while True:
+        batch = list(islice(numbered, batch_size))
+        if not batch:
+            break
+        records = []
+        errors = []
+        for number, line in batch:
+            try:
+                records.append((number, parse_line(line)))
+            except ValueError as error:
+                errors.append((number, str(error)))
+        try:
+            with transaction.atomic():
+                created, batch_errors = import_batch(records, default_author)
+        except IntegrityError:
+            created, batch_errors = 0, [
+                (number, "Пачка не записана из-за конфликта в базе, "
+                         "повторите загрузку этих строк")
+                for number, _ in records
+            ]
+        result["created"] += created
+        result["errors"] += [{"line": number, "message": message}
+                             for number, message
+                             in sorted(errors + batch_errors)]
+
+    if result["created"]:
+        invalidate_page_counts()
+        pantry_index.invalidate()
+    return result
@@ -0,0 +1,98 @@
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import (FavoriteRecipe,
+                            ShoppingCartRecipe,
+                            TrendingRun,
+                            TrendingScore)
+
+# веса событий приводятся к этой дате: вес события в момент t равен
+# exp(rate * (t - EPOCH)), общий множитель затухания exp(-rate * now)
+# одинаков для всех рецептов и на порядок рецептов не влияет
+EPOCH = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def decay_rate():
+    return math.log(2) / settings.TRENDING_HALF_LIFE
+
+
+def trending_threshold(now=None):
+    """минимальная хранимая оценка рецептов, текущая популярность
+    которых не меньше TRENDING_MIN_SCORE"""
+    now = now or timezone.now()
+    return (decay_rate() * (now - EPOCH).total_seconds()
+            + math.log(settings.TRENDING_MIN_SCORE))
+
+
+def add_events(events, weight):
+    """добавляет к оценкам рецептов события [(id рецепта, время)]:
+    оценки хранятся логарифмами, суммы считаются через logaddexp"""
+    recipes_id = np.fromiter((recipe_id for recipe_id, _ in events),
+                             dtype=np.int64, count=len(events))
+    moments = np.fromiter(((created - EPOCH).total_seconds()
+                           for _, created in events),
+                          dtype=np.float64, count=len(events))
+    keys, positions = np.unique(recipes_id, return_inverse=True)
+    scores = np.full(len(keys), -np.inf)
+    np.logaddexp.at(scores, positions,
+                    moments * decay_rate() + math.log(weight))
+
+    keys = keys.tolist()
+    existing = dict(TrendingScore.objects.filter(
+        recipe__in=keys
+    ).values_list("recipe_id", "score"))
+    scores = np.logaddexp(
+        scores, [existing.get(recipe_id, -np.inf) for recipe_id in keys]
+    ).tolist()
+    TrendingScore.objects.bulk_update(
+        [TrendingScore(recipe_id=recipe_id, score=score)
+         for recipe_id, score in zip(keys, scores) if recipe_id in existing],
+        ["score"], batch_size=1000
+    )
+    TrendingScore.objects.bulk_create(
+        [TrendingScore(recipe_id=recipe_id, score=score)
+         for recipe_id, score in zip(keys, scores)
+         if recipe_id not in existing],
+        batch_size=1000
+    )
+
+
+def compute_trending(batch_size):
+    """учитывает в оценках добавления в избранное и корзину с момента
+    прошлого запуска; события последних TRENDING_EVENT_DELAY секунд
+    откладываются до следующего запуска, чтобы не пропустить еще не
+    зафиксированные транзакции; возвращает количество событий"""
+    with transaction.atomic():
+        last_run = TrendingRun.objects.select_for_update().first()
+        since = last_run.computed_until if last_run else None
+        until = timezone.now() - timedelta(
+            seconds=settings.TRENDING_EVENT_DELAY
+        )
+        if since is not None and since >= until:
+            return 0
+
+        events_count = 0
+        for model, weight in (
+                (FavoriteRecipe, settings.TRENDING_FAVORITE_WEIGHT),
+                (ShoppingCartRecipe, settings.TRENDING_CART_WEIGHT)):
+            events = model.objects.filter(created__lte=until)
+            if since is not None:
+                events = events.filter(created__gt=since)
+            events = events.values_list(
+                "recipe_id", "created"
+            ).order_by().iterator(chunk_size=batch_size)
+            while True:
+                chunk = list(islice(events, batch_size))
+                if not chunk:
+                    break
+                add_events(chunk, weight)
+                events_count += len(chunk)
+
+        TrendingRun.objects.create(computed_until=until, events=events_count)
+    return events_count
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """прерывает разбор multipart-запроса, как только загружаемый файл
+    превышает RECIPE_IMAGE_MAX_SIZE, до сохранения и проверки файла"""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.RECIPE_IMAGE_MAX_SIZE:
+            raise MultiPartParserError(
+                f"Размер файла {self.file_name} больше "
+                f"{settings.RECIPE_IMAGE_MAX_SIZE} байт"
+            )
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
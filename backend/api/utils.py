@@ -1,30 +1,230 @@
 from collections import defaultdict
+from itertools import islice
 
-from recipes.models import IngredientRecipe
+from django.conf import settings
+from django.db.models import (Case, Count, F, IntegerField, Q, Sum, Value,
+                              When)
+from django.db.models.functions import Greatest
+
+from recipes.models import (FeedRecipe,
+                            IngredientRecipe,
+                            Recipe,
+                            ShoppingCartIngredient,
+                            Subscribe,
+                            Tag)
+from recipes.queries import first_in_groups
+
+
+def change_counter(model, pk, field, delta):
+    """атомарно изменяет счетчик field в строке модели на delta,
+    значение не опускается ниже нуля"""
+    if delta:
+        model.objects.filter(pk=pk).update(
+            **{field: Greatest(F(field) + delta, Value(0))}
+        )
+
+
+def recipe_ingredients_amount(recipe):
+    """возвращает словарь {id ингредиента: количество} для рецепта"""
+    return dict(
+        IngredientRecipe.objects.filter(recipe=recipe).values_list(
+            'ingredient_id', 'amount'
+        )
+    )
+
+
+def change_shopping_list(users_id, amounts):
+    """изменяет список покупок пользователей на количество ингредиентов
+    из словаря {id ингредиента: изменение количества}, отрицательное
+    изменение уменьшает количество, нулевые записи удаляются"""
+    amounts = {ingredient_id: amount
+               for ingredient_id, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    users_id = list(users_id)
+    if not users_id:
+        return
+
+    ShoppingCartIngredient.objects.bulk_create(
+        [ShoppingCartIngredient(user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=0)
+         for user_id in users_id
+         for ingredient_id, amount in amounts.items() if amount > 0],
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+    shopping_list = ShoppingCartIngredient.objects.filter(
+        user__in=users_id,
+        ingredient__in=amounts
+    )
+    shopping_list.update(amount=Greatest(
+        F('amount') + Case(
+            *[When(ingredient_id=ingredient_id, then=Value(amount))
+              for ingredient_id, amount in amounts.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    ))
+    shopping_list.filter(amount=0).delete()
+
+
+def add_to_shopping_list(users_id, recipe):
+    """добавляет ингредиенты рецепта в список покупок пользователей"""
+    change_shopping_list(users_id, recipe_ingredients_amount(recipe))
+
+
+def remove_from_shopping_list(users_id, recipe):
+    """убирает ингредиенты рецепта из списка покупок пользователей"""
+    change_shopping_list(
+        users_id,
+        {ingredient_id: -amount for ingredient_id, amount
+         in recipe_ingredients_amount(recipe).items()}
+    )
+
+
+def calculate_shopping_lists(users_id):
+    """возвращает рассчитанные по корзине списки покупок пользователей
+    в виде словаря {(id пользователя, id ингредиента): количество}"""
+    totals = IngredientRecipe.objects.filter(
+        recipe__cart__user__in=users_id
+    ).values_list('recipe__cart__user', 'ingredient').annotate(
+        total_amount=Sum('amount')
+    ).order_by()
+    return {(user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in totals}
+
+
+def recipes_by_author(authors_id, limit=None):
+    """возвращает словарь {id автора: список рецептов} одним запросом,
+    при заданном limit - не больше limit первых рецептов каждого автора,
+    номер рецепта у автора считается оконной функцией"""
+    recipes = Recipe.objects.filter(author__in=authors_id).only(
+        "id", "name", "image", "image_variants", "cooking_time", "author"
+    )
+    if limit is not None:
+        sql, params = first_in_groups(
+            recipes, "author", [F("name").asc(), F("id").asc()], limit
+        )
+        recipes = Recipe.objects.raw(f"{sql} ORDER BY ranked.name", params)
+
+    result = defaultdict(list)
+    for recipe in recipes:
+        result[recipe.author_id].append(recipe)
+    return result
+
+
+def recipe_facets(recipes):
+    """количество рецептов по тэгам и по интервалам времени приготовления
+    из COOKING_TIME_BUCKETS одним запросом: рецепты группируются по
+    интервалу, количество с каждым тэгом считается в той же группировке,
+    по тэгам результат суммируется по интервалам"""
+    bounds = settings.COOKING_TIME_BUCKETS
+    tags = list(Tag.objects.values_list("id", "slug"))
+    rows = recipes.order_by().annotate(cooking_time_bucket=Case(
+        *[When(cooking_time__lte=bound, then=Value(number))
+          for number, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+        output_field=IntegerField()
+    )).values("cooking_time_bucket").annotate(
+        recipes_count=Count("id", distinct=True),
+        **{f"tag_{tag_id}": Count("id", distinct=True,
+                                  filter=Q(tag=tag_id))
+           for tag_id, _ in tags}
+    )
+
+    buckets = [0] * (len(bounds) + 1)
+    tags_count = dict.fromkeys((tag_id for tag_id, _ in tags), 0)
+    for row in rows:
+        buckets[row["cooking_time_bucket"]] = row["recipes_count"]
+        for tag_id in tags_count:
+            tags_count[tag_id] += row[f"tag_{tag_id}"]
+    return {
+        "tags": [{"slug": slug, "count": tags_count[tag_id]}
+                 for tag_id, slug in tags],
+        "cooking_time": [
+            {"from": low, "to": high, "count": count}
+            for low, high, count in zip((0, *bounds), (*bounds, None),
+                                        buckets)
+        ],
+    }
+
+
+def is_popular_author(author):
+    """у популярных авторов рецепты не рассылаются по лентам подписчиков,
+    а добавляются в ленту при ее чтении"""
+    return Subscribe.objects.filter(following=author).count() > (
+        settings.FEED_FANOUT_THRESHOLD
+    )
+
+
+def fan_out_recipe(recipe):
+    """добавляет новый рецепт в ленты подписчиков автора пачками"""
+    if is_popular_author(recipe.author):
+        return
+    followers_id = Subscribe.objects.filter(
+        following=recipe.author
+    ).values_list("user_id", flat=True).iterator()
+    while True:
+        batch = list(islice(followers_id, settings.FEED_FANOUT_BATCH_SIZE))
+        if not batch:
+            break
+        FeedRecipe.objects.bulk_create(
+            [FeedRecipe(user_id=user_id, recipe=recipe,
+                        author_id=recipe.author_id)
+             for user_id in batch],
+            ignore_conflicts=True
+        )
+
+
+def fill_feed(user, author):
+    """добавляет в ленту пользователя последние рецепты автора
+    при подписке на него"""
+    if is_popular_author(author):
+        return
+    recipes_id = author.recipes.order_by("-id").values_list(
+        "id", flat=True
+    )[:settings.FEED_BACKFILL_SIZE]
+    FeedRecipe.objects.bulk_create(
+        [FeedRecipe(user=user, recipe_id=recipe_id, author=author)
+         for recipe_id in recipes_id],
+        ignore_conflicts=True
+    )
+
+
+def clear_feed(user, author):
+    """убирает рецепты автора из ленты пользователя при отписке"""
+    FeedRecipe.objects.filter(user=user, author=author).delete()
+
+
+def feed_recipes(user, recipes):
+    """отбирает из recipes рецепты ленты пользователя: разосланные
+    в ленту и рецепты популярных авторов, на которых он подписан"""
+    popular_authors = Subscribe.objects.filter(
+        following__in=user.subscription.values("id")
+    ).values("following").annotate(
+        followers=Count("id")
+    ).filter(
+        followers__gt=settings.FEED_FANOUT_THRESHOLD
+    ).values("following")
+    return recipes.filter(
+        Q(id__in=user.feed.values("recipe"))
+        | Q(author__in=popular_authors)
+    )
 
 
 def shopping_cart_data(user):
-    """функция возвращает информацию в виде строк о
-    необходимых ингериеднтах рецептов, которые добавлены в корзину"""
-
-    """переменные для формирования текстового файла"""
-    recipes_name = set()
-    ingredient_dict = defaultdict(int)
-
-    shopping_cart_recipes = user.shopping_cart_recipe.all()
-    for recipe in shopping_cart_recipes:
-        recipes_name.add(recipe.name)
-        ingredients = IngredientRecipe.objects.filter(recipe=recipe)
-        for ingredient in ingredients:
-            ingredient_dict[
-                (f'{ingredient.ingredient.name}, '
-                 f'{ingredient.ingredient.measurement_unit}')
-            ] += ingredient.amount
-
-    data = (f'Ваши рецепты: {", ".join(list(recipes_name))}\n'
-            f'Необходимые ингредиенты для всех рецептов:\n')
-    for ingredient, amount in ingredient_dict.items():
-        ingredient, measurement_unit = ingredient.split(', ')
-        data += f'- {ingredient}: {amount} {measurement_unit}\n'
-
-    return data
+    """генератор возвращает построчно информацию о необходимых
+    ингредиентах рецептов, которые добавлены в корзину,
+    количество берется из списка покупок пользователя"""
+    recipes_name = user.shopping_cart_recipe.values_list('name', flat=True)
+    yield f'Ваши рецепты: {", ".join(recipes_name)}\n'
+    yield 'Необходимые ингредиенты для всех рецептов:\n'
+
+    ingredients = user.shopping_list.values_list(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name')
+
+    for name, measurement_unit, amount in ingredients.iterator():
+        yield f'- {name}: {amount} {measurement_unit}\n'
@@ -1,8 +1,14 @@
+from django.conf import settings as django_settings
 from django.contrib.auth import update_session_auth_hash
-from django.http import HttpResponse
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import filters, viewsets, permissions, status, mixins
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser import utils
@@ -10,6 +16,7 @@ from djoser.compat import get_user_email
 from djoser.conf import settings
 
 from recipes.models import (Ingredient,
+                            IngredientRecipe,
                             FavoriteRecipe,
                             User,
                             Recipe,
@@ -17,6 +24,7 @@ from recipes.models import (Ingredient,
                             Subscribe,
                             ShoppingCartRecipe)
 from .serializers import (IngredientSerializer,
+                          PantryRecipeSerializer,
                           RecipeSerializer,
                           RecipeCreateSerializer,
                           RecipeFavoriteSerializer,
@@ -27,9 +35,27 @@ from .serializers import (IngredientSerializer,
                           SubscribeSerializer,
                           SubscriptionUserSerializer)
 from .permissions import IsUserOrReadAndCreate, IsAuthorOrReadOnly
+from .caching import reference_cache
 from .filters import IngredientFilter, RecipeFilter
-from .utils import shopping_cart_data
-from .pagination import CustomPagination
+from .images import delete_image_variants
+from .indexes import ingredient_index, pantry_index
+from .membership import (FAVORITES,
+                         SHOPPING_CART,
+                         SUBSCRIPTIONS,
+                         change_membership)
+from .utils import (add_to_shopping_list,
+                    change_counter,
+                    clear_feed,
+                    feed_recipes,
+                    fill_feed,
+                    recipe_facets,
+                    recipes_by_author,
+                    remove_from_shopping_list,
+                    shopping_cart_data)
+from .pagination import CustomPagination, FeedPagination
+from .transfer import export_recipes, import_recipes
+from .trending import trending_threshold
+from .uploads import MaxSizeUploadHandler
 
 
 class CreateDeleteViewSet(mixins.CreateModelMixin,
@@ -39,6 +65,23 @@ class CreateDeleteViewSet(mixins.CreateModelMixin,
     pass
 
 
+class CachedListMixin:
+    """список без параметров запроса отдается из заранее подготовленного
+    в памяти ответа с etag, версия меняется при изменении записей"""
+    reference_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+
+        def render():
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            return JSONRenderer().render(serializer.data)
+
+        return reference_cache.get(self.reference_name,
+                                   render).response(request)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     permission_classes = [IsUserOrReadAndCreate]
     queryset = User.objects.all()
@@ -54,9 +97,26 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(permission_classes=(permissions.IsAuthenticated,), detail=False)
     def subscriptions(self, request):
-        follower = self.request.user.subscription.all()
+        """рецепты всех авторов страницы получаются одним запросом,
+        recipes_limit ограничивает количество рецептов у каждого автора"""
+        recipes_limit = request.query_params.get("recipes_limit")
+        if recipes_limit is not None and not recipes_limit.isdigit():
+            return Response(
+                {"message": "recipes_limit должен быть целым "
+                            "неотрицательным числом"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
+        follower = self.request.user.subscription.order_by("id")
         page = self.paginate_queryset(follower)
+
+        recipes = recipes_by_author(
+            [author.id for author in page],
+            None if recipes_limit is None else int(recipes_limit)
+        )
+        for author in page:
+            author.page_recipes = recipes[author.id]
+
         serializer = SubscriptionUserSerializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
@@ -85,14 +145,16 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    reference_name = "tags"
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(CachedListMixin, viewsets.ReadOnlyModelViewSet):
+    reference_name = "ingredients"
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter,]
@@ -101,35 +163,156 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    def list(self, request, *args, **kwargs):
+        """поиск ингредиента по имени идет по индексу в памяти,
+        без параметра name возвращается весь список"""
+        name = request.query_params.get("name")
+        if not name:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(ingredient_index.search(name),
+                                         many=True)
+        return Response(serializer.data)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.select_related("author").prefetch_related(
+        "tag",
+        Prefetch(
+            "ingredientrecipe_set",
+            queryset=IngredientRecipe.objects.select_related("ingredient")
+        )
+    )
     permission_classes = [IsAuthorOrReadOnly,
                           permissions.IsAuthenticatedOrReadOnly]
     pagination_class = CustomPagination
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
+
+    def initialize_request(self, request, *args, **kwargs):
+        """файлы из multipart-запроса сразу пишутся во временный файл,
+        слишком большие отклоняются при чтении запроса"""
+        request.upload_handlers = [MaxSizeUploadHandler(request),
+                                   TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.method == "GET":
             return RecipeSerializer
         return RecipeCreateSerializer
 
+    def list(self, request, *args, **kwargs):
+        """список рецептов и количество рецептов по тэгам и времени
+        приготовления для текущего фильтра"""
+        response = super().list(request, *args, **kwargs)
+        response.data["facets"] = recipe_facets(
+            self.filter_queryset(self.get_queryset())
+        )
+        return response
+
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        remove_from_shopping_list(
+            instance.cart.values_list("user_id", flat=True), instance
+        )
+        delete_image_variants(instance)
+        instance.delete()
+        change_counter(User, instance.author_id, "recipes_count", -1)
+
+    @action(permission_classes=(permissions.IsAuthenticated,),
+            pagination_class=FeedPagination,
+            detail=False)
+    def feed(self, request):
+        """лента рецептов авторов, на которых подписан пользователь"""
+        recipes = feed_recipes(request.user,
+                               self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def trending(self, request):
+        """популярные сейчас рецепты по оценкам, которые считает
+        команда compute_trending"""
+        recipes = self.filter_queryset(self.get_queryset()).select_related(
+            "trending"
+        ).filter(
+            trending__score__gte=trending_threshold()
+        ).order_by("-trending__score", "id")
+        page = self.paginate_queryset(recipes)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def pantry(self, request):
+        """рецепты, которые можно приготовить из ингредиентов пользователя
+        (параметр ingredients - id через запятую): сначала те, для которых
+        есть все ингредиенты, затем без одного, без двух и т.д. до
+        PANTRY_MAX_MISSING недостающих"""
+        ingredients_id = [
+            ingredient_id.strip()
+            for value in request.query_params.getlist("ingredients")
+            for ingredient_id in value.split(",") if ingredient_id.strip()
+        ]
+        if not ingredients_id or not all(
+                ingredient_id.isdigit() for ingredient_id in ingredients_id):
+            return Response(
+                {"message": "Укажите id ингредиентов через запятую"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipes_id, missing = pantry_index.search(
+            map(int, ingredients_id), django_settings.PANTRY_MAX_MISSING
+        )
+        missing = dict(self.paginate_queryset(
+            list(zip(recipes_id, missing))
+        ))
+        recipes = self.get_queryset().in_bulk(missing)
+        page = []
+        for recipe_id, missing_ingredients in missing.items():
+            if recipe_id in recipes:
+                recipe = recipes[recipe_id]
+                recipe.missing_ingredients = missing_ingredients
+                page.append(recipe)
+        serializer = PantryRecipeSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(permission_classes=(permissions.IsAdminUser,), detail=False,
+            url_path="export")
+    def export_recipes(self, request):
+        """выгрузка всех рецептов потоком в json lines"""
+        response = StreamingHttpResponse(
+            export_recipes(django_settings.RECIPE_EXPORT_CHUNK_SIZE),
+            content_type='application/x-ndjson; charset=UTF-8'
+        )
+        response['Content-Disposition'] = 'attachment; filename=recipes.ndjson'
+        return response
+
+    @action(permission_classes=(permissions.IsAdminUser,), detail=False,
+            methods=["post"], url_path="import")
+    def import_recipes(self, request):
+        """загрузка рецептов из json lines в теле запроса, тело читается
+        построчно, ошибки возвращаются с номерами строк"""
+        stream = request.stream
+        lines = iter(stream.readline, b"") if stream is not None else []
+        result = import_recipes(lines, request.user,
+                                django_settings.RECIPE_IMPORT_BATCH_SIZE)
+        return Response(result, status=status.HTTP_200_OK)
+
     @action(permission_classes=(permissions.IsAuthenticated,), detail=False)
     def download_shopping_cart(self, request):
         """функция возвращает при api запросе текстовый файл со списком ингредиентов
-        всех рецептов, которые были в корзине у аутентифицированного юзера"""
-        data = shopping_cart_data(request.user)
-
+        всех рецептов, которые были в корзине у аутентифицированного юзера,
+        файл отдается потоком и не сохраняется на диск"""
         filename = 'cart.txt'
-        cart_text = open(filename, 'w')
-        cart_text.write(data)
-
-        response = HttpResponse(data,
-                                content_type='text/plain; charset=UTF-8')
+        response = StreamingHttpResponse(
+            shopping_cart_data(request.user),
+            content_type='text/plain; charset=UTF-8'
+        )
         response['Content-Disposition'] = 'attachment; filename=' + filename
         return response
 
@@ -137,10 +320,15 @@ class RecipeViewSet(viewsets.ModelViewSet):
 class SubscribeViewSet(CreateDeleteViewSet):
     serializer_class = SubscribeSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         follow_id = self.kwargs.get("user_id")
         follow = get_object_or_404(User, id=follow_id)
         serializer.save(user=self.request.user, following=follow)
+        change_counter(User, follow.id, "followers_count", 1)
+        fill_feed(self.request.user, follow)
+        change_membership(self.request.user.id, SUBSCRIPTIONS, follow.id,
+                          added=True)
 
     @action(methods=['delete'],
             permission_classes=(permissions.IsAuthenticated,),
@@ -157,7 +345,12 @@ class SubscribeViewSet(CreateDeleteViewSet):
                             "вы на этого автора и небыли подписаны"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        queryset.delete()
+        with transaction.atomic():
+            deleted, _ = queryset.delete()
+            change_counter(User, follow.id, "followers_count", -deleted)
+            clear_feed(self.request.user, follow)
+            change_membership(self.request.user.id, SUBSCRIPTIONS,
+                              follow.id, added=False)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -166,10 +359,14 @@ class RecipeFavoriteViewSet(CreateDeleteViewSet):
     для текущего пользователя"""
     serializer_class = RecipeFavoriteSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         recipe_id = self.kwargs.get("recipe_id")
         recipe = get_object_or_404(Recipe, id=recipe_id)
         serializer.save(user=self.request.user, recipe=recipe)
+        change_counter(Recipe, recipe.id, "favorites_count", 1)
+        change_membership(self.request.user.id, FAVORITES, recipe.id,
+                          added=True)
 
     @action(methods=['delete'],
             permission_classes=(permissions.IsAuthenticated,),
@@ -186,7 +383,11 @@ class RecipeFavoriteViewSet(CreateDeleteViewSet):
                             "возможно рецепта и не было в избранном"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        queryset.delete()
+        with transaction.atomic():
+            deleted, _ = queryset.delete()
+            change_counter(Recipe, recipe.id, "favorites_count", -deleted)
+            change_membership(self.request.user.id, FAVORITES, recipe.id,
+                              added=False)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -195,10 +396,15 @@ class RecipeShoppingCartViewSet(CreateDeleteViewSet):
     для текущего пользователя"""
     serializer_class = RecipeShoppingCartSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         recipe_id = self.kwargs.get("recipe_id")
         recipe = get_object_or_404(Recipe, id=recipe_id)
         serializer.save(user=self.request.user, recipe=recipe)
+        change_counter(Recipe, recipe.id, "carts_count", 1)
+        add_to_shopping_list([self.request.user.id], recipe)
+        change_membership(self.request.user.id, SHOPPING_CART, recipe.id,
+                          added=True)
 
     @action(methods=['delete'],
             permission_classes=(permissions.IsAuthenticated,),
@@ -217,5 +423,10 @@ class RecipeShoppingCartViewSet(CreateDeleteViewSet):
                             "возможно рецепта и не было в корзине"},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        queryset.delete()
+        with transaction.atomic():
+            deleted, _ = queryset.delete()
+            change_counter(Recipe, recipe.id, "carts_count", -deleted)
+            remove_from_shopping_list([self.request.user.id], recipe)
+            change_membership(self.request.user.id, SHOPPING_CART,
+                              recipe.id, added=False)
         return Response(status=status.HTTP_204_NO_CONTENT)
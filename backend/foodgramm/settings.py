@@ -34,6 +34,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +75,28 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='default'),
+    },
+    'membership': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='membership'),
+        'KEY_PREFIX': 'membership',
+        'TIMEOUT': 600,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -114,7 +137,11 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.timing.TimedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.timing.TimedJSONRenderer',
+        'api.timing.TimedBrowsableAPIRenderer',
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 9,
@@ -138,3 +165,59 @@ CSRF_TRUSTED_ORIGINS = [
     "http://*51.250.109.6",
     "https://*51.250.109.6"
 ]
+
+INGREDIENT_SEARCH_LIMIT = 50
+INGREDIENT_INDEX_TTL = 300
+
+PANTRY_INDEX_TTL = 300
+PANTRY_MAX_MISSING = 2
+
+FEED_FANOUT_THRESHOLD = 1000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 50
+
+PAGINATION_COUNT_CACHE_TTL = 30
+
+COOKING_TIME_BUCKETS = (15, 30, 60)
+
+TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+TRENDING_FAVORITE_WEIGHT = 1.0
+TRENDING_CART_WEIGHT = 2.0
+TRENDING_MIN_SCORE = 0.05
+TRENDING_EVENT_DELAY = 60
+
+REFERENCE_CACHE_GZIP = True
+REFERENCE_CACHE_TTL = 300
+
+RECIPE_IMAGE_SIZES = {
+    "thumbnail": 160,
+    "card": 480,
+    "full": 1200,
+}
+RECIPE_IMAGE_QUALITY = 80
+RECIPE_IMAGE_MAX_SIZE = 20 * 1024 * 1024
+
+RECIPE_EXPORT_CHUNK_SIZE = 2000
+RECIPE_IMPORT_BATCH_SIZE = 500
+
+ADMIN_PREVIEW_SIZE = 5
+
+SERVER_TIMING_SAMPLE_RATE = 0.05
+SERVER_TIMING_HEADER = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -1,18 +1,86 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.auth.admin import UserAdmin
+from django.db import connections
+from django.db.models import F
 
-from .models import (Ingredient,
+from .models import (ImageTask,
+                     Ingredient,
                      IngredientRecipe,
                      FavoriteRecipe,
                      Recipe,
+                     ShoppingCartIngredient,
                      ShoppingCartRecipe,
                      Subscribe,
                      Tag,
                      TagRecipe,
+                     TrendingRun,
                      User)
+from .queries import count_of, first_in_groups
+from .search import search_recipes
 
 
-class CustomUserModel(UserAdmin):
+def first_related(model, field, values, objects_id, limit):
+    """{id объекта: первые limit значений values} одним запросом"""
+    sql, params = first_in_groups(
+        model.objects.filter(**{f"{field}__in": objects_id}).values_list(
+            field, *values
+        ).order_by(),
+        field, [F(values[0]).asc(), F("id").asc()], limit
+    )
+    result = defaultdict(list)
+    with connections[model.objects.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        for object_id, *row, position in cursor.fetchall():
+            result[object_id].append((position, row))
+    return {object_id: [row for _, row in sorted(rows)]
+            for object_id, rows in result.items()}
+
+
+class PreviewChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = list(self.result_list)
+        self.model_admin.load_previews(self.result_list)
+
+
+class PreviewAdmin(admin.ModelAdmin):
+    """в списке объектов связанные записи показываются превью из
+    ADMIN_PREVIEW_SIZE первых значений и общим количеством: количество
+    берется из аннотации queryset, превью загружаются одним запросом
+    на связь для всей страницы
+    previews: {имя превью: (модель, поле ссылки на объект, поля значения,
+    имя аннотации с количеством)}"""
+    previews = {}
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return PreviewChangeList
+
+    def load_previews(self, objects):
+        objects_id = [obj.pk for obj in objects]
+        for name, (model, field, values, _) in self.previews.items():
+            rows = first_related(model, field, values, objects_id,
+                                 settings.ADMIN_PREVIEW_SIZE)
+            for obj in objects:
+                setattr(obj, f"{name}_preview", rows.get(obj.pk, []))
+
+    def preview(self, obj, name, format_row=" ".join):
+        _, _, _, count_field = self.previews[name]
+        rows = getattr(obj, f"{name}_preview", None)
+        if rows is None:
+            return None
+        count = getattr(obj, count_field)
+        preview = ", ".join(format_row(map(str, row)) for row in rows)
+        if count > len(rows):
+            return f"{preview} … (всего {count})"
+        return preview or None
+
+
+class CustomUserModel(UserAdmin, PreviewAdmin):
     list_display = (
         "id",
         "username",
@@ -24,8 +92,35 @@ class CustomUserModel(UserAdmin):
         "get_shopping_cart_recipe"
     )
     search_fields = ("username", "email")
-    list_filter = ("username", "email")
+    list_filter = ("is_staff", "is_active")
     empty_value_display = "-пусто-"
+    previews = {
+        "subscription": (Subscribe, "user", ("following__username",),
+                         "subscriptions_count"),
+        "favorite": (FavoriteRecipe, "user", ("recipe__name",),
+                     "favorites_count"),
+        "shopping_cart": (ShoppingCartRecipe, "user", ("recipe__name",),
+                          "carts_count"),
+    }
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            subscriptions_count=count_of(Subscribe, "user"),
+            favorites_count=count_of(FavoriteRecipe, "user"),
+            carts_count=count_of(ShoppingCartRecipe, "user")
+        )
+
+    @admin.display(description="Подписки на пользователей")
+    def get_subscription(self, obj):
+        return self.preview(obj, "subscription")
+
+    @admin.display(description="Избранные рецепты")
+    def get_favorite_recipe(self, obj):
+        return self.preview(obj, "favorite")
+
+    @admin.display(description="Рецепты в корзине")
+    def get_shopping_cart_recipe(self, obj):
+        return self.preview(obj, "shopping_cart")
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -37,9 +132,10 @@ class TagAdmin(admin.ModelAdmin):
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ("name", "measurement_unit")
     search_fields = ("name",)
+    show_full_result_count = False
 
 
-class RecipeAdmin(admin.ModelAdmin):
+class RecipeAdmin(PreviewAdmin):
     readonly_fields = ("count_favorite",)
     list_display = ("id",
                     "name",
@@ -50,11 +146,46 @@ class RecipeAdmin(admin.ModelAdmin):
                     "get_tag",
                     "get_ingredient",
                     "count_favorite")
-
-    search_fields = ("name", "author__username", "tag__name")
+    list_select_related = ("author",)
+    search_fields = ("name",)
+    search_help_text = ("Поиск по словам в названии и описании рецепта, "
+                        "@username - рецепты автора")
+    previews = {
+        "tag": (TagRecipe, "recipe", ("tag__name",), "tags_count"),
+        "ingredient": (IngredientRecipe, "recipe",
+                       ("ingredient__name", "amount",
+                        "ingredient__measurement_unit"),
+                       "ingredients_count"),
+    }
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            tags_count=count_of(TagRecipe, "recipe"),
+            ingredients_count=count_of(IngredientRecipe, "recipe")
+        )
+
+    def get_search_results(self, request, queryset, search_term):
+        """поиск по полнотекстовому индексу рецептов или по началу
+        username автора, без JOIN по тэгам и без DISTINCT"""
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.startswith("@"):
+            return queryset.filter(
+                author__username__startswith=search_term[1:]
+            ), False
+        return search_recipes(queryset, search_term), False
+
+    @admin.display(description="Тэги рецепта")
+    def get_tag(self, obj):
+        return self.preview(obj, "tag")
+
+    @admin.display(description="Ингредиенты рецепта")
+    def get_ingredient(self, obj):
+        return self.preview(obj, "ingredient")
 
     def count_favorite(self, obj):
-        return FavoriteRecipe.objects.filter(recipe=obj).count()
+        return obj.favorites_count
 
     count_favorite.short_description = 'Количество добавлений в избранное'
 
@@ -72,11 +203,24 @@ class SubscribeAdmin(admin.ModelAdmin):
 
 
 class FavoriteRecipeAdmin(admin.ModelAdmin):
-    list_display = ("user", "recipe")
+    list_display = ("user", "recipe", "created")
 
 
 class ShoppingCartRecipeAdmin(admin.ModelAdmin):
-    list_display = ("user", "recipe")
+    list_display = ("user", "recipe", "created")
+
+
+class ShoppingCartIngredientAdmin(admin.ModelAdmin):
+    list_display = ("user", "ingredient", "amount")
+
+
+class ImageTaskAdmin(admin.ModelAdmin):
+    list_display = ("recipe", "status", "attempts", "created")
+    list_filter = ("status",)
+
+
+class TrendingRunAdmin(admin.ModelAdmin):
+    list_display = ("created", "computed_until", "events")
 
 
 admin.site.register(User, CustomUserModel)
@@ -88,3 +232,6 @@ admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
 admin.site.register(Subscribe, SubscribeAdmin)
 admin.site.register(FavoriteRecipe, FavoriteRecipeAdmin)
 admin.site.register(ShoppingCartRecipe, ShoppingCartRecipeAdmin)
+admin.site.register(ShoppingCartIngredient, ShoppingCartIngredientAdmin)
+admin.site.register(ImageTask, ImageTaskAdmin)
+admin.site.register(TrendingRun, TrendingRunAdmin)
@@ -0,0 +1,51 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feed(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    FeedRecipe = apps.get_model('recipes', 'FeedRecipe')
+    feed = Recipe.objects.filter(
+        author__subscribe_user__isnull=False
+    ).values_list('author__subscribe_user__user', 'id', 'author')
+    FeedRecipe.objects.bulk_create(
+        (FeedRecipe(user_id=user_id, recipe_id=recipe_id, author_id=author_id)
+         for user_id, recipe_id, author_id in feed.iterator()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0030_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='recipes.recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Рецепт в ленте',
+                'verbose_name_plural': 'Рецепты в лентах',
+                'ordering': ['user', '-recipe'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='feedrecipe',
+            index=models.Index(fields=['user', 'author'], name='feed_user_author_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedrecipe',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_user_feed_recipe'),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
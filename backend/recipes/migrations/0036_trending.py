@@ -0,0 +1,58 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0035_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('computed_until', models.DateTimeField(verbose_name='События учтены до')),
+                ('events', models.PositiveIntegerField(verbose_name='Обработано событий')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Запуск')),
+            ],
+            options={
+                'verbose_name': 'Запуск расчета популярности',
+                'verbose_name_plural': 'Запуски расчета популярности',
+                'ordering': ['-computed_until'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingScore',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='recipes.recipe')),
+                ('score', models.FloatField(db_index=True, verbose_name='Оценка')),
+            ],
+            options={
+                'verbose_name': 'Популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+                'ordering': ['-score'],
+            },
+        ),
+        migrations.AddField(
+            model_name='favoriterecipe',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='Добавлен'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcartrecipe',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, null=True, verbose_name='Добавлен'),
+        ),
+        migrations.AddIndex(
+            model_name='favoriterecipe',
+            index=models.Index(fields=['created'], name='favorite_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcartrecipe',
+            index=models.Index(fields=['created'], name='cart_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+INDEX = "ingredient_name_trgm_idx"
+
+
+def install(apps, schema_editor):
+    """на PostgreSQL поиск по вхождению в названии ингредиента в админке
+    (UPPER(name) LIKE '%...%') использует триграммный GIN-индекс"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX} ON recipes_ingredient "
+        f"USING GIN (UPPER(name::text) gin_trgm_ops)"
+    )
+
+
+def uninstall(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0036_trending'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:48
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+AMOUNT_MAX = 32767
+
+
+def merge_rows(model, owner, duplicate_id, kept_id, limit=None):
+    """переносит строки дубликата на оставшийся ингредиент; если у
+    владельца уже есть строка с ним, количества складываются"""
+    for row in model.objects.filter(ingredient_id=duplicate_id):
+        kept = model.objects.filter(
+            **{owner: getattr(row, owner)}, ingredient_id=kept_id
+        ).first()
+        if kept is None:
+            row.ingredient_id = kept_id
+            row.save(update_fields=['ingredient'])
+            continue
+        kept.amount += row.amount
+        if limit is not None:
+            kept.amount = min(kept.amount, limit)
+        kept.save(update_fields=['amount'])
+        row.delete()
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    ShoppingCartIngredient = apps.get_model('recipes',
+                                            'ShoppingCartIngredient')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        kept_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in groups.iterator():
+        duplicates = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['kept_id']).values_list('id', flat=True))
+        for duplicate_id in duplicates:
+            merge_rows(IngredientRecipe, 'recipe_id', duplicate_id,
+                       group['kept_id'], limit=AMOUNT_MAX)
+            merge_rows(ShoppingCartIngredient, 'user_id', duplicate_id,
+                       group['kept_id'])
+        Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0038_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient_name_unit'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.5 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0039_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagetask',
+            name='started',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Взята в обработку'),
+        ),
+        migrations.AlterField(
+            model_name='imagetask',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает обработки'), ('processing', 'Обрабатывается'), ('done', 'Обработано'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Статус'),
+        ),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from .storage import content_storage
 from .validators import (validate_above_zero,
                          validate_cooking_time,
                          validate_color_tag,
@@ -27,6 +28,16 @@ class User(AbstractUser):
         through="ShoppingCartRecipe",
         related_name="shopping_cart_recipe"
     )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество подписчиков"
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество рецептов"
+    )
 
     def get_subscription(self):
         return ", ".join(
@@ -91,6 +102,13 @@ class Ingredient(models.Model):
         verbose_name = "Ингредиент"
         ordering = ["name"]
 
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"],
+                name="unique_ingredient_name_unit"
+            )
+        ]
+
     def __str__(self):
         return self.name
 
@@ -106,10 +124,26 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/',
+        storage=content_storage,
         blank=True,
         null=True,
         verbose_name='Изображение'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name="Уменьшенные копии изображения"
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество добавлений в избранное"
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Количество добавлений в корзину"
+    )
     tag = models.ManyToManyField(Tag, through="TagRecipe")
     ingredient = models.ManyToManyField(
         Ingredient,
@@ -138,6 +172,12 @@ class Recipe(models.Model):
         verbose_name_plural = "Рецепты"
         verbose_name = "Рецепт"
         ordering = ["name"]
+        indexes = [
+            models.Index(fields=["-favorites_count", "-carts_count", "id"],
+                         name="recipe_popularity_idx"),
+            models.Index(fields=["author", "name", "id"],
+                         name="recipe_author_name_idx")
+        ]
 
     def __str__(self):
         return self.name
@@ -158,6 +198,10 @@ class TagRecipe(models.Model):
                 name="unique_tag_recipe"
             )
         ]
+        indexes = [
+            models.Index(fields=["recipe", "tag"],
+                         name="tag_recipe_recipe_idx")
+        ]
 
     def __str__(self):
         return f"{self.tag} {self.recipe}"
@@ -221,6 +265,9 @@ class FavoriteRecipe(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                related_name="favorite")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True,
+                                   null=True,
+                                   verbose_name="Добавлен")
 
     class Meta:
         verbose_name_plural = "Избранные рецепты"
@@ -233,6 +280,10 @@ class FavoriteRecipe(models.Model):
                 name="unique_user_favorite_recipe"
             )
         ]
+        indexes = [
+            models.Index(fields=["created"],
+                         name="favorite_created_idx")
+        ]
 
     def __str__(self):
         return f"{self.user} {self.recipe}"
@@ -242,6 +293,9 @@ class ShoppingCartRecipe(models.Model):
     recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
                                related_name="cart")
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True,
+                                   null=True,
+                                   verbose_name="Добавлен")
 
     class Meta:
         verbose_name_plural = "Рецепты в корзине"
@@ -254,6 +308,156 @@ class ShoppingCartRecipe(models.Model):
                 name="unique_user_shopping_cart_recipe"
             )
         ]
+        indexes = [
+            models.Index(fields=["created"],
+                         name="cart_created_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.user} {self.recipe}"
+
+
+class ShoppingCartIngredient(models.Model):
+    """суммарное количество ингредиента во всех рецептах корзины
+    пользователя, обновляется при изменении корзины и рецептов"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="shopping_list")
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    amount = models.PositiveIntegerField(verbose_name="Количество")
+
+    class Meta:
+        verbose_name_plural = "Ингредиенты в списке покупок"
+        verbose_name = "Ингредиент в списке покупок"
+        ordering = ["user"]
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_user_shopping_cart_ingredient"
+            )
+        ]
+
+    def __str__(self):
+        return (f"{self.user} {self.ingredient} "
+                f"{self.amount} {self.ingredient.measurement_unit}")
+
+
+class FeedRecipe(models.Model):
+    """лента пользователя - рецепты авторов, на которых он подписан,
+    заполняется при создании рецепта и при подписке на автора"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="feed")
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name="feed")
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name="+")
+
+    class Meta:
+        verbose_name_plural = "Рецепты в лентах"
+        verbose_name = "Рецепт в ленте"
+        ordering = ["user", "-recipe"]
+
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"],
+                name="unique_user_feed_recipe"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["user", "author"],
+                         name="feed_user_author_idx")
+        ]
 
     def __str__(self):
         return f"{self.user} {self.recipe}"
+
+
+class ImageTask(models.Model):
+    """очередь обработки изображений рецептов, задачи выполняет
+    команда process_images"""
+    PENDING = "pending"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = (
+        (PENDING, "Ожидает обработки"),
+        (PROCESSING, "Обрабатывается"),
+        (DONE, "Обработано"),
+        (FAILED, "Ошибка"),
+    )
+
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name="image_tasks")
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=PENDING, verbose_name="Статус")
+    attempts = models.PositiveSmallIntegerField(default=0,
+                                                verbose_name="Попытки")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name="Создана")
+    started = models.DateTimeField(null=True, blank=True,
+                                   verbose_name="Взята в обработку")
+
+    class Meta:
+        verbose_name_plural = "Обработка изображений"
+        verbose_name = "Обработка изображения"
+        ordering = ["id"]
+        indexes = [
+            models.Index(fields=["status", "id"],
+                         name="image_task_status_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.recipe} {self.status}"
+
+
+class RecipeSearch(models.Model):
+    """поисковый индекс рецептов FTS5 на SQLite, таблица создается
+    и обновляется триггерами из recipes.search, на PostgreSQL
+    вместо нее колонка search_vector в таблице рецептов"""
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.DO_NOTHING,
+                                  primary_key=True,
+                                  db_column="rowid",
+                                  related_name="search")
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = "recipes_recipe_fts"
+
+
+class TrendingScore(models.Model):
+    """популярность рецепта с затуханием по времени, пересчитывается
+    командой compute_trending; хранится логарифм суммы весов добавлений
+    в избранное и корзину, приведенных к начальной дате, поэтому старые
+    оценки не нужно пересчитывать при каждом запуске"""
+    recipe = models.OneToOneField(Recipe,
+                                  on_delete=models.CASCADE,
+                                  primary_key=True,
+                                  related_name="trending")
+    score = models.FloatField(db_index=True, verbose_name="Оценка")
+
+    class Meta:
+        verbose_name_plural = "Популярность рецептов"
+        verbose_name = "Популярность рецепта"
+        ordering = ["-score"]
+
+    def __str__(self):
+        return f"{self.recipe} {self.score}"
+
+
+class TrendingRun(models.Model):
+    """запуски compute_trending: события до computed_until учтены"""
+    computed_until = models.DateTimeField(verbose_name="События учтены до")
+    events = models.PositiveIntegerField(verbose_name="Обработано событий")
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name="Запуск")
+
+    class Meta:
+        verbose_name_plural = "Запуски расчета популярности"
+        verbose_name = "Запуск расчета популярности"
+        ordering = ["-computed_until"]
+
+    def __str__(self):
+        return f"{self.computed_until} {self.events}"
@@ -0,0 +1,27 @@
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+
+
+def count_of(model, field):
+    """количество записей model, ссылающихся полем field на объект,
+    подзапросом для annotate"""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef("pk")}).order_by().values(
+            field
+        ).annotate(count=Count("id")).values("count")
+    ), 0)
+
+
+def first_in_groups(queryset, field, order_by, limit):
+    """sql и параметры запроса первых limit строк queryset в каждой
+    группе по field в порядке order_by: номер строки в группе (колонка
+    row_position, последняя) считается оконной функцией, отбор по нему -
+    во внешнем запросе"""
+    ranked = queryset.annotate(row_position=Window(
+        expression=RowNumber(),
+        partition_by=[F(field)],
+        order_by=order_by
+    ))
+    sql, params = ranked.query.sql_with_params()
+    return (f"SELECT * FROM ({sql}) AS ranked "
+            f"WHERE ranked.row_position <= %s", (*params, limit))
@@ -0,0 +1,136 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField
+from django.db.models.expressions import RawSQL
+
+TABLE = "recipes_recipe"
+FTS_TABLE = "recipes_recipe_fts"
+SEARCH_CONFIG = "russian"
+SEARCH_INDEX = "recipe_search_idx"
+
+# на PostgreSQL - вычисляемая хранимая колонка tsvector с GIN-индексом,
+# название рецепта весит больше описания
+POSTGRESQL_INSTALL = (
+    f"ALTER TABLE {TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    f"GENERATED ALWAYS AS ("
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+    f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')"
+    f") STORED",
+    f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX} "
+    f"ON {TABLE} USING GIN (search_vector)",
+)
+POSTGRESQL_UNINSTALL = (
+    f"DROP INDEX IF EXISTS {SEARCH_INDEX}",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+)
+
+# на SQLite - таблица FTS5 над рецептами, синхронизируется триггерами
+SQLITE_TRIGGERS = {
+    f"{FTS_TABLE}_insert": (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert "
+        f"AFTER INSERT ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, name, text) "
+        f"VALUES (new.id, new.name, new.text); END"
+    ),
+    f"{FTS_TABLE}_delete": (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete "
+        f"AFTER DELETE ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); END"
+    ),
+    f"{FTS_TABLE}_update": (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update "
+        f"AFTER UPDATE OF name, text ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); "
+        f"INSERT INTO {FTS_TABLE} (rowid, name, text) "
+        f"VALUES (new.id, new.name, new.text); END"
+    ),
+}
+SQLITE_REBUILD = (
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"
+)
+# релевантность rank - bm25, название весит больше описания
+SQLITE_RANK = (
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) "
+    f"VALUES ('rank', 'bm25(10.0, 1.0)')"
+)
+
+
+def install_search(connection):
+    """создает поисковый индекс рецептов для PostgreSQL или SQLite"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for sql in POSTGRESQL_INSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == "sqlite":
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, text, content='{TABLE}', "
+                f"content_rowid='id', tokenize='unicode61')"
+            )
+            cursor.execute(SQLITE_RANK)
+            repair_search(connection)
+
+
+def uninstall_search(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            for sql in POSTGRESQL_UNINSTALL:
+                cursor.execute(sql)
+        elif connection.vendor == "sqlite":
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def repair_search(connection):
+    """SQLite при пересоздании таблицы рецептов в миграциях удаляет
+    ее триггеры: они создаются заново, а индекс перестраивается"""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name = %s", [FTS_TABLE]
+        )
+        if cursor.fetchone() is None:
+            return
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = %s", [TABLE]
+        )
+        if SQLITE_TRIGGERS.keys() <= {name for name, in cursor.fetchall()}:
+            return
+        for sql in SQLITE_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(SQLITE_REBUILD)
+
+
+def fts_query(query):
+    """слова запроса для FTS5: каждое в кавычках и с поиском по началу
+    слова, так как морфологии для русского языка в SQLite нет"""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search_recipes(queryset, query):
+    """отбирает рецепты, подходящие под поисковый запрос, и добавляет
+    релевантность search_rank: чем больше, тем выше рецепт в выдаче"""
+    if connections[queryset.db].vendor == "postgresql":
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        return queryset.filter(RawSQL(
+            f"{TABLE}.search_vector @@ {tsquery}", (query,),
+            output_field=BooleanField()
+        )).annotate(search_rank=RawSQL(
+            f"ts_rank({TABLE}.search_vector, {tsquery})", (query,),
+            output_field=FloatField()
+        ))
+
+    query = fts_query(query)
+    if not query:
+        return queryset.none()
+    return queryset.filter(RawSQL(
+        f"{FTS_TABLE} MATCH %s", (query,), output_field=BooleanField()
+    ), search__isnull=False).annotate(search_rank=-F("search__rank"))